@@ -0,0 +1,514 @@
+"""
+Benchmarks for pyentity
+
+Run with
+
+    python bench.py                         # every scenario
+    python bench.py --filter call           # the scenarios matching call
+    python bench.py --save baseline.json    # keep the results
+    python bench.py --compare baseline.json # and compare against them later
+    python bench.py --memory                # bytes per instance
+    python bench.py --sharded               # sharded rendering across cores
+
+Each scenario reports operations per second (best of a few repeats) and,
+on Python 3, the memory blocks and bytes one operation allocates
+and still holds when it returns (its result included)
+"""
+from __future__ import print_function
+
+import gc
+import sys
+import json
+import time
+import timeit
+import argparse
+import datetime
+import platform
+import multiprocessing
+
+try:
+    import tracemalloc
+except ImportError:
+    # Python 2
+    tracemalloc = None
+
+import pyentity
+
+########################################
+# Fixtures, as in the README
+
+class GeorgeWashington(object):
+    id = 1776
+    first_name = 'George'
+    last_name = 'Washington'
+    phone_number = '(202) 456-1111'
+    phone_number_private = True
+    email = 'prez1@whouse.gov'
+    accomplishments = ['president', 'general', 'quarter model', 'woodworking']
+    birthday = datetime.datetime(1732, 2, 22, 0, 0)
+
+
+class UserEntity(pyentity.Entity):
+    _FIELDS_ = [
+        'id',
+        'name',
+        'phone_number',
+        'email',
+        'accomplishments',
+        'birthday',
+    ]
+    _ALIAS_ = 'user'
+    _AUX_OBJECTS_ = ['db']
+
+    def name(self):
+        return "%s %s" % (self.user.first_name, self.user.last_name)
+
+    def birthday(self):
+        return self.user.birthday.isoformat()
+
+    def phone_number(self):
+        if self.user.phone_number_private:
+            raise pyentity.SuppressField
+        return self.user.phone_number
+
+
+class SlottedUserEntity(pyentity.SlottedEntity):
+    _FIELDS_ = UserEntity._FIELDS_
+    _ALIAS_ = UserEntity._ALIAS_
+    _AUX_OBJECTS_ = UserEntity._AUX_OBJECTS_
+
+    name = UserEntity.__dict__['name']
+    birthday = UserEntity.__dict__['birthday']
+    phone_number = UserEntity.__dict__['phone_number']
+
+
+class CompiledUserEntity(UserEntity):
+    _COMPILED_ = True
+
+
+class DescriptorUserEntity(UserEntity):
+    _DESCRIPTORS_ = True
+
+########################################
+# Generated fixtures
+
+class Wide(object):
+    """
+    Object with attributes f0, f1, ... for the entities of wide_entity
+    """
+
+    def __init__(self, count):
+        for i in range(count):
+            setattr(self, 'f%d' % i, i)
+
+def wide_entity(count):
+    """
+    Entity class of count fields, every other one a method
+    and the rest proxied to a Wide object
+    """
+    def method(i):
+        def field(self):
+            return getattr(self._o, 'f%d' % i)
+        return field
+
+    dct = {'_FIELDS_' : ['f%d' % i for i in range(count)]}
+    for i in range(0, count, 2):
+        dct['f%d' % i] = method(i)
+    return type(pyentity.Entity)('Wide%dEntity' % count, (pyentity.Entity,), dct)
+
+def deep_entity(depth):
+    """
+    UserEntity with depth levels of subclasses under it,
+    the ChildEntity(MainEntity) pattern
+    """
+    klass = UserEntity
+    for i in range(depth):
+        klass = type(pyentity.Entity)('Depth%dEntity' % (i + 1), (klass,), {})
+    return klass
+
+def proxied_entity(count, source=None):
+    """
+    Entity class of count fields, all proxied to the wrapped object,
+    a Wide object or (with source 'items') a dictionary
+    """
+    dct = {'_FIELDS_' : ['f%d' % i for i in range(count)], '_SOURCE_' : source}
+    return type(pyentity.Entity)('Proxied%dEntity' % count, (pyentity.Entity,), dct)
+
+def suppressing_entity(percent, returned=False):
+    """
+    Entity class of 10 method fields, percent of which suppress themselves,
+    by raising SuppressField or with returned, by returning SUPPRESS
+    """
+    def method(suppressed):
+        def field(self):
+            if suppressed:
+                if returned:
+                    return pyentity.SUPPRESS
+                raise pyentity.SuppressField
+            return 1
+        return field
+
+    dct = {'_FIELDS_' : ['f%d' % i for i in range(10)]}
+    for i in range(10):
+        dct['f%d' % i] = method(i * 10 < percent)
+    return type(pyentity.Entity)('Suppressing%dEntity' % percent, (pyentity.Entity,), dct)
+
+########################################
+# Scenarios
+#
+# Each is a function doing its setup and returning
+# the operation to measure, a function of no arguments
+
+SCENARIOS = []
+
+def scenario(name):
+    def register(setup):
+        SCENARIOS.append((name, setup))
+        return setup
+    return register
+
+def user_entity(klass=UserEntity):
+    return klass(GeorgeWashington(), db=object())
+
+@scenario('init')
+def bench_init():
+    obj = GeorgeWashington()
+    db = object()
+    return lambda: UserEntity(obj, db=db)
+
+@scenario('getattr_proxy')
+def bench_getattr_proxy():
+    entity = user_entity()
+    return lambda: entity.email
+
+@scenario('getattr_method')
+def bench_getattr_method():
+    entity = user_entity()
+    return lambda: entity.name
+
+@scenario('getattr_alias')
+def bench_getattr_alias():
+    entity = user_entity()
+    return lambda: entity.user
+
+@scenario('getattr_alias_descriptors')
+def bench_getattr_alias_descriptors():
+    entity = user_entity(DescriptorUserEntity)
+    return lambda: entity.user
+
+@scenario('iter')
+def bench_iter():
+    entity = user_entity()
+    return lambda: list(entity)
+
+@scenario('call')
+def bench_call():
+    return user_entity()
+
+@scenario('call_compiled')
+def bench_call_compiled():
+    return user_entity(CompiledUserEntity)
+
+@scenario('call_slotted')
+def bench_call_slotted():
+    return user_entity(SlottedUserEntity)
+
+@scenario('row')
+def bench_row():
+    return user_entity().row
+
+@scenario('row_compiled')
+def bench_row_compiled():
+    return user_entity(CompiledUserEntity).row
+
+@scenario('dumps')
+def bench_dumps():
+    entity = user_entity()
+    return lambda: json.dumps(entity())
+
+@scenario('encode')
+def bench_encode():
+    return user_entity().encode
+
+@scenario('rshift')
+def bench_rshift():
+    entity = user_entity()
+    return lambda: entity >> {}
+
+@scenario('render_many_100')
+def bench_render_many():
+    objs = [GeorgeWashington() for i in range(100)]
+    db = object()
+    return lambda: UserEntity.render_many(objs, db=db)
+
+@scenario('render_rows_100')
+def bench_render_rows():
+    objs = [GeorgeWashington() for i in range(100)]
+    db = object()
+    return lambda: UserEntity.render_rows(objs, db=db)
+
+def register_call(name, klass, obj, **aux):
+    @scenario(name)
+    def bench():
+        return klass(obj, **aux)
+
+for count in (1, 10, 50):
+    register_call('fields_%d' % count, wide_entity(count), Wide(count))
+
+register_call('proxied_20', proxied_entity(20), Wide(20))
+register_call('proxied_20_items', proxied_entity(20, 'items'), vars(Wide(20)))
+
+for percent in (0, 50, 100):
+    register_call('suppressed_%d%%' % percent, suppressing_entity(percent), None)
+    register_call('suppressed_%d%%_returned' % percent, suppressing_entity(percent, True), None)
+
+def register_render_many(name, klass):
+    @scenario(name)
+    def bench():
+        objs = [None] * 100
+        return lambda: klass.render_many(objs)
+
+register_render_many('render_many_100_suppressed_50%', suppressing_entity(50))
+register_render_many('render_many_100_suppressed_50%_returned', suppressing_entity(50, True))
+
+for depth in (1, 4, 8):
+    register_call('depth_%d' % depth, deep_entity(depth), GeorgeWashington(), db=object())
+
+########################################
+# Measuring
+
+def ops_per_second(func, repeat=3, min_time=0.2):
+    """
+    Calls per second of func, best of repeat runs of at least min_time seconds
+    """
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= min_time:
+            break
+        number *= 2
+
+    best = elapsed
+    for i in range(repeat - 1):
+        best = min(best, timeit.timeit(func, number=number))
+    return number / best
+
+def allocations(func, number=1000):
+    """
+    Memory one call to func allocates, averaged over number calls whose
+    results are kept: the peak bytes allocated during the call, temporary
+    objects included, and the blocks and bytes still held when it returns
+
+    Nones on Python 2, which has no tracemalloc
+    """
+    if tracemalloc is None:
+        return None, None, None
+
+    func()
+    results = [None] * number
+    gc.collect()
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        for i in range(number):
+            results[i] = func()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+
+    blocks = size = 0
+    for stat in after.compare_to(before, 'filename'):
+        blocks += stat.count_diff
+        size += stat.size_diff
+
+    # tracing from nothing for each call, its peak is all the call allocated
+    # (the results above are kept too, so that freeing them does not refill
+    # the free lists that the calls would otherwise take objects from)
+    peak = 0
+    kept = [None] * number
+    for i in range(number):
+        tracemalloc.start()
+        try:
+            kept[i] = func()
+            peak += tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+    return peak / float(number), blocks / float(number), size / float(number)
+
+def run(pattern=None):
+    """
+    Runs every scenario whose name contains pattern,
+    returning a dictionary of name to results
+    """
+    results = {}
+    for name, setup in SCENARIOS:
+        if pattern and not pattern in name:
+            continue
+
+        func = setup()
+        peak, blocks, size = allocations(func)
+        results[name] = {
+            'ops_per_sec' : ops_per_second(func),
+            'peak_bytes_per_op' : peak,
+            'retained_blocks_per_op' : blocks,
+            'retained_bytes_per_op' : size,
+        }
+        report(name, results[name])
+
+    return results
+
+def change(result, baseline):
+    """
+    Speed change from baseline to result, in percent
+    """
+    return (result['ops_per_sec'] / baseline['ops_per_sec'] - 1) * 100
+
+def report(name, result, baseline=None):
+    line = '  %-40s %12.0f ops/s' % (name, result['ops_per_sec'])
+    if result.get('peak_bytes_per_op') is not None:
+        line += ' %9.1f bytes peak %7.1f blocks %9.1f bytes retained' % (
+            result['peak_bytes_per_op'],
+            result['retained_blocks_per_op'],
+            result['retained_bytes_per_op'],
+        )
+    if baseline is not None:
+        line += '  %+6.1f%%' % change(result, baseline)
+    print(line)
+
+########################################
+# Saving and comparing
+
+def save(results, path):
+    with open(path, 'w') as f:
+        json.dump({
+            'python' : platform.python_version(),
+            'time' : time.time(),
+            'results' : results,
+        }, f, indent=2, sort_keys=True)
+
+def compare(results, path, threshold):
+    """
+    Prints results against the baseline saved at path, and returns
+    the names of the scenarios more than threshold percent slower
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+
+    print('compared to %s (Python %s)' % (path, baseline['python']))
+
+    regressions = []
+    for name, setup in SCENARIOS:
+        if not name in results:
+            continue
+
+        previous = baseline['results'].get(name)
+        report(name, results[name], previous)
+        if previous is not None and change(results[name], previous) < -threshold:
+            regressions.append(name)
+
+    return regressions
+
+########################################
+# Memory
+
+def instance_size(entity):
+    """
+    Bytes held by entity itself: the instance, its __dict__ if it has one,
+    and the dictionaries and tuples it references directly or through __dict__
+
+    The class, the wrapped object and the aux objects are shared, so not counted
+    """
+    size = sys.getsizeof(entity)
+
+    for referent in gc.get_referents(entity):
+        if isinstance(referent, (dict, tuple)):
+            size += sys.getsizeof(referent)
+        if isinstance(referent, dict):
+            for value in referent.values():
+                if isinstance(value, (dict, tuple)):
+                    size += sys.getsizeof(value)
+
+    return size
+
+def bench_memory():
+    """
+    Bytes per instance of a plain and a slotted entity, after a render
+    """
+    obj = GeorgeWashington()
+    db = object()
+
+    print('memory (bytes per instance, after rendering)')
+    for klass in (UserEntity, SlottedUserEntity):
+        entity = klass(obj, db=db)
+        entity()
+        print('  %-20s %6d' % (klass.__name__, instance_size(entity)))
+
+########################################
+# Sharded rendering
+
+def user_aux_objects():
+    """
+    Aux object factory of the workers of iter_render_sharded
+    """
+    return {'db' : object()}
+
+def bench_sharded(count=200000):
+    """
+    Objects rendered per second by render_many in this process,
+    and by iter_render_sharded across 1, 2, 4... up to as many processes as cores
+    """
+    objs = [GeorgeWashington() for i in range(count)]
+
+    print('sharded rendering (%d objects, objects per second)' % count)
+
+    start = time.time()
+    UserEntity.render_many(objs, db=object())
+    print('  %-20s %10d' % ('render_many', count / (time.time() - start)))
+
+    cores = multiprocessing.cpu_count()
+    processes = 1
+    while True:
+        start = time.time()
+        for chunk in UserEntity.iter_render_sharded(objs, processes, aux_factory=user_aux_objects):
+            pass
+        print('  %-20s %10d' % ('%d processes' % processes, count / (time.time() - start)))
+
+        if processes >= cores:
+            break
+        processes = min(processes * 2, cores)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks for pyentity')
+    parser.add_argument('--filter', help='only run the scenarios whose name contains this')
+    parser.add_argument('--save', metavar='PATH', help='save the results as JSON to PATH')
+    parser.add_argument('--compare', metavar='PATH', help='compare against the results saved at PATH')
+    parser.add_argument('--threshold', type=float, default=10.0,
+        help='percent slower than the baseline that counts as a regression (default 10)')
+    parser.add_argument('--memory', action='store_true', help='measure bytes per instance instead')
+    parser.add_argument('--sharded', action='store_true', help='measure sharded rendering instead')
+    args = parser.parse_args()
+
+    if args.memory:
+        bench_memory()
+        return
+    if args.sharded:
+        bench_sharded()
+        return
+
+    print('scenarios (Python %s)' % platform.python_version())
+    results = run(args.filter)
+
+    if args.save:
+        save(results, args.save)
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print('regressions: %s' % ', '.join(regressions))
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,9 +1,72 @@
 import re
+import io
+import csv
+import copy
+import json
+import time
+import types
 import keyword
+import operator
+import itertools
+import threading
+import collections
+import multiprocessing
 
 DUNDER_MANGLE_RE = re.compile(r'__\w+?__|_Entity__\w+')
 IDENTIFIER_RE = re.compile(r'^[_a-zA-Z]\w*$')
 BOOTSTRAP_ATTRS = ('_ALIAS_', '_FIELDS_', '_o', '_AUX_OBJECTS_')
+CONFIG_ATTRS = ('_COMPILED_', '_BATCH_SIZE_', '_DESCRIPTORS_', '_CACHE_', '_PREFETCH_', '_SOURCE_',
+    '_VERSIONS_')
+RESERVED_ATTRS = BOOTSTRAP_ATTRS + CONFIG_ATTRS
+
+# parameters of the constructor and the bulk renderers, which aux objects
+# (passed along as keyword arguments) cannot be named
+RENDER_OPTIONS = (
+    'obj',
+    'klass',
+    'objects',
+    'fp',
+    'concurrency',
+    'timeout',
+    'only',
+    'exclude',
+    'format',
+    'buffer_size',
+    'progress',
+)
+
+# how many distinct only/exclude projections each class caches, see EntityPlan.project
+MAX_PROJECTIONS = 256
+
+# how much encoded output dump and Entity.export hold before writing it out
+DEFAULT_BUFFER_SIZE = 64 * 1024
+
+try:
+    string_types = (str, unicode)
+    integer_types = (int, long)
+    text_type = unicode
+except NameError:
+    # Python 3
+    string_types = (str,)
+    integer_types = (int,)
+    text_type = str
+
+# best clock for timing fields, see Instrumentation
+timer = getattr(time, 'perf_counter', time.time)
+
+def add_metaclass(metaclass):
+    """
+    Class decorator recreating the class with metaclass,
+    the same way on Python 2 and 3
+    """
+    def wrapper(klass):
+        dct = dict(klass.__dict__)
+        for slot in dct.get('__slots__', ()):
+            dct.pop(slot)
+        dct.pop('__dict__', None)
+        dct.pop('__weakref__', None)
+        return metaclass(klass.__name__, klass.__bases__, dct)
+    return wrapper
 
 def is_legal_identifier(ident):
     """
@@ -14,33 +77,588 @@ def is_legal_identifier(ident):
 class SuppressField(Exception):
     pass
 
-class Entity(object):
+class SuppressedType(object):
+    """
+    Type of SUPPRESS, which a field can return to suppress itself
+    without the cost of raising SuppressField, and which stands for
+    a suppressed field in rows (see Entity.row), where fields have
+    no key to leave out
+    """
 
-    # list of fields to present
-    _FIELDS_ = None
+    __slots__ = ()
 
-    # alias for the wrapped object `_o`
-    _ALIAS_ = None
+    def __repr__(self):
+        return 'SUPPRESS'
 
-    # list of required aux objects
-    _AUX_OBJECTS_ = None
+    def __reduce__(self):
+        # unpickles as the same SUPPRESS
+        return 'SUPPRESS'
 
-    def __init__(self, obj=None, **kwargs):
+SUPPRESS = SuppressedType()
+
+class RawJSON(object):
+    """
+    Pre-encoded JSON for the value of a field, as text, bytes
+    or a memoryview of UTF-8 bytes
+
+    iterencode, dump and Entity.export splice it into their output
+    as it is, instead of encoding the value. It is not checked,
+    so it has to be valid JSON
+    """
+
+    __slots__ = ('fragment',)
+
+    def __init__(self, fragment):
+        self.fragment = fragment
+
+    def __repr__(self):
+        return 'RawJSON(%r)' % (self.fragment,)
+
+    def __eq__(self, other):
+        return isinstance(other, RawJSON) and self.text() == other.text()
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
+    def text(self):
+        """
+        Returns the fragment as text, decoding bytes only once
+        """
+        fragment = self.fragment
+        if isinstance(fragment, string_types):
+            return fragment
+
+        if isinstance(fragment, memoryview):
+            if text_type is str:
+                # straight from the buffer, without copying it to bytes first
+                return str(fragment, 'utf-8')
+            fragment = fragment.tobytes()
+
+        return fragment.decode('utf-8')
+
+    def load(self):
+        """
+        Parses the fragment, for consumers that need the value itself
+        """
+        return json.loads(self.text())
+
+class batched(object):
+    """
+    Decorator declaring an entity method as a batched field
+
+    The method is called like a classmethod with a list of entities,
+    and returns a list with the value of the field for each of them.
+    An element that is SUPPRESS or SuppressField (or an instance of it)
+    suppresses the field for that entity only.
+
+    Bulk rendering calls it once per batch of entities,
+    rendering a single entity calls it with a list of one.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, owner):
+        return classmethod(self.func).__get__(instance, owner)
+
+class io_bound(object):
+    """
+    Decorator declaring an entity method as an I/O-bound field
+
+    Rendering calls the I/O-bound fields of the entity (or of a whole batch
+    of entities, when bulk rendering) in the shared thread pool of io_pool
+    before resolving the other fields, so that their blocking calls overlap.
+
+    Read from the entity outside of a render, it is called in
+    the calling thread like any other method.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __get__(self, instance, owner):
+        return self.func.__get__(instance, owner)
+
+# number of threads in the shared pool running io_bound fields
+IO_POOL_SIZE = 8
+
+io_pool_lock = threading.Lock()
+shared_io_pool = None
+
+def io_pool():
+    """
+    Returns the shared concurrent.futures thread pool running io_bound fields,
+    creating it with IO_POOL_SIZE threads on first use
+
+    On Python 2 this needs the futures backport
+    """
+    global shared_io_pool
+
+    with io_pool_lock:
+        if shared_io_pool is None:
+            from concurrent.futures import ThreadPoolExecutor
+            shared_io_pool = ThreadPoolExecutor(IO_POOL_SIZE)
+        return shared_io_pool
+
+# marks the threads of the shared io_pool, see call_io_field
+io_thread = threading.local()
+
+def call_io_field(func, *args):
+    """
+    Calls func, an io_bound field (or instrumentation.call of one),
+    in a thread of the shared io_pool, marking the thread as such
+    """
+    io_thread.in_pool = True
+    return func(*args)
+
+def set_io_pool_size(size):
+    """
+    Sets the number of threads running io_bound fields
+
+    The current pool is shut down once its queued fields are done,
+    and the next render starts a new one with size threads
+    """
+    global IO_POOL_SIZE, shared_io_pool
+
+    with io_pool_lock:
+        IO_POOL_SIZE = size
+        previous, shared_io_pool = shared_io_pool, None
+
+    if previous is not None:
+        previous.shutdown(wait=False)
+
+def is_suppressed(value):
+    """
+    Checks if a value returned by a batched field suppresses the field
+    """
+    return value is SUPPRESS or value is SuppressField or isinstance(value, SuppressField)
+
+def iter_chunks(iterable, size):
+    """
+    Yields lists of up to size items from iterable
+    """
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+# key of the related data of the prefetch hook in the memo of a render,
+# which is never a field name
+PREFETCHED = ('prefetched',)
+
+# How a field gets its value, see EntityPlan
+CONSTANT_FIELD = 'constant'     # class attribute of the entity
+METHOD_FIELD = 'method'         # method of the entity, called with the entity
+PROXY_FIELD = 'proxy'           # proxied to the wrapped object `_o`
+ITEM_FIELD = 'item'             # proxied to an item of the wrapped mapping or row `_o`
+BATCHED_FIELD = 'batched'       # batched method of the entity, see batched
+IO_FIELD = 'io'                 # I/O-bound method of the entity, see io_bound
+
+# What a render builds, see EntityPlan.renderer
+DICT_OUTPUT = 'dict'            # dictionary of the fields, see Entity.__call__
+ROW_OUTPUT = 'row'              # tuple of the values of the fields, see Entity.row
+JSON_OUTPUT = 'json'            # JSON object as UTF-8 bytes, see Entity.encode
+
+def resolve_field(entity, field, kind, value):
+    """
+    Resolves one field of entity from its (kind, value) entry
+    in the resolution table of the class plan
+
+     - a constant is returned as is
+     - a method (I/O-bound or not) is called with the entity
+     - a proxy is looked up on the wrapped object, and called if callable
+     - an item is looked up in the wrapped mapping or row, and returned as is
+     - a batched method is called with a batch of just the entity
+
+    Throws an AttributeError if a proxied field is missing from the wrapped object
+    A field suppresses itself by returning SUPPRESS
+    or throwing a SuppressField exception
+    """
+    if kind is CONSTANT_FIELD:
+        return value
+
+    if kind is METHOD_FIELD:
+        return value(entity)
+
+    if kind is BATCHED_FIELD:
+        value = value(type(entity), [entity])[0]
+        if is_suppressed(value):
+            return SUPPRESS
+        return value
+
+    if kind is IO_FIELD:
+        return value(entity)
+
+    if kind is ITEM_FIELD:
+        try:
+            return object.__getattribute__(entity, '_o')[field]
+        except (KeyError, IndexError):
+            raise_missing_field(entity, field)
+
+    try:
+        value = getattr(object.__getattribute__(entity, '_o'), field)
+    except AttributeError:
+        raise_missing_field(entity, field)
+
+    if callable(value):
+        return value()
+    else:
+        return value
+
+def resolve_memoized(entity, memo, field, kind, value):
+    """
+    Resolves one field of entity like resolve_field, but through memo,
+    the dictionary of field values of the current render
+
+    A suppressed field is memoized as SUPPRESS,
+    and raises SuppressField when read
+    """
+    try:
+        result = memo[field]
+    except KeyError:
+        try:
+            result = resolve_field(entity, field, kind, value)
+        except SuppressField:
+            result = SUPPRESS
+        memo[field] = result
+
+        # read it back, the memo of an async render wraps awaitables
+        result = memo[field]
+
+    if result is SUPPRESS:
+        raise SuppressField
+    return result
+
+def resolve_unmemoized(entity, field, kind, value):
+    """
+    Resolves one field of entity like resolve_field, outside of a render,
+    throwing SuppressField for a suppressed field
+    """
+    result = resolve_field(entity, field, kind, value)
+    if result is SUPPRESS:
+        raise SuppressField
+    return result
+
+class Instrumentation(object):
+    """
+    Statistics of field resolution per (entity class, field):
+    how the field is resolved (its kind), how many times, the cumulative
+    and maximum wall time of those calls, and how many of them suppressed
+    the field or raised another exception
+
+    Time is inclusive: a field reading another field includes its time.
+    Memoized reads are not resolutions, so they are not counted.
+
+    hook, if given, is called with (klass, field, kind, elapsed, outcome)
+    after every resolution, outcome being one of 'ok', 'suppressed'
+    or 'error', to export them to a metrics system
+    """
+
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.lock = threading.Lock()
+        self.stats = {}
+
+    def call(self, klass, field, kind, func, *args):
+        """
+        Calls func with args, recording it as a resolution of field of klass
+        """
+        outcome = 'ok'
+        start = timer()
+        try:
+            result = func(*args)
+            if result is SUPPRESS:
+                outcome = 'suppressed'
+            return result
+        except SuppressField:
+            outcome = 'suppressed'
+            raise
+        except Exception:
+            outcome = 'error'
+            raise
+        finally:
+            self.record(klass, field, kind, timer() - start, outcome)
+
+    def record(self, klass, field, kind, elapsed, outcome):
+        with self.lock:
+            try:
+                stats = self.stats[klass, field]
+            except KeyError:
+                stats = self.stats[klass, field] = {
+                    'kind' : kind,
+                    'calls' : 0,
+                    'total_time' : 0.0,
+                    'max_time' : 0.0,
+                    'suppressed' : 0,
+                    'errors' : 0,
+                }
+
+            stats['calls'] += 1
+            stats['total_time'] += elapsed
+            if elapsed > stats['max_time']:
+                stats['max_time'] = elapsed
+            if outcome == 'suppressed':
+                stats['suppressed'] += 1
+            elif outcome == 'error':
+                stats['errors'] += 1
+
+        if self.hook is not None:
+            self.hook(klass, field, kind, elapsed, outcome)
+
+    def snapshot(self):
+        """
+        Returns a copy of the statistics, as a dictionary
+        of (klass, field) to a dictionary of statistics
+        """
+        with self.lock:
+            return dict((key, dict(stats)) for key, stats in self.stats.items())
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+# the current Instrumentation, None when disabled
+instrumentation = None
+
+# resolve_field itself, while enable_instrumentation swaps in a timed one
+untimed_resolve_field = resolve_field
+
+def timed_resolve_field(entity, field, kind, value):
+    """
+    resolve_field, recorded by the current Instrumentation
+    """
+    return instrumentation.call(
+        type(entity), field, kind, untimed_resolve_field,
+        entity, field, kind, value,
+    )
+
+def enable_instrumentation(hook=None):
+    """
+    Starts recording field resolution in a new Instrumentation, and returns it
+
+    Rendering, attribute access and bulk rendering all go through
+    the module global resolve_field, which is swapped for
+    timed_resolve_field, so that nothing is paid while disabled.
+    Compiled renders inline their fields, so they fall back to
+    EntityPlan.render meanwhile
+    """
+    global instrumentation, resolve_field
 
-        # store this to save calls to __getattribute__
-        klass = self.__class__
+    instrumentation = Instrumentation(hook)
+    resolve_field = timed_resolve_field
+    return instrumentation
+
+def disable_instrumentation():
+    """
+    Stops recording field resolution, and returns the last Instrumentation
+    """
+    global instrumentation, resolve_field
+
+    previous, instrumentation = instrumentation, None
+    resolve_field = untimed_resolve_field
+    return previous
+
+def instrumentation_snapshot():
+    """
+    Statistics of the current Instrumentation, see Instrumentation.snapshot
+    """
+    if instrumentation is None:
+        return {}
+    return instrumentation.snapshot()
+
+def reset_instrumentation():
+    if instrumentation is not None:
+        instrumentation.reset()
+
+def raise_missing_field(entity, field):
+    """
+    Raises the AttributeError for a proxied field
+    that the wrapped object does not have
+    """
+    raise AttributeError("Cannot find a value for attribute %r in %s" % (
+        field,
+        type(entity).__name__,
+    ))
+
+def projection_key(only, exclude):
+    """
+    Normalizes the only and exclude arguments of a render into a hashable key
+    """
+    return (
+        None if only is None else frozenset(only),
+        None if exclude is None else frozenset(exclude),
+    )
+
+class RenderCache(object):
+    """
+    Cache of rendered entities across renders, for the _CACHE_ of an Entity class
+
+    key is called with the wrapped object and the dictionary of aux objects
+    and returns what identifies the rendered output, for instance
+    (obj.id, obj.version), or None to not cache that entity.
+    Entries are shared by every class using this cache, keyed by
+    entity class and only/exclude projection under each key.
+
+    At most max_size keys are kept, evicting the least recently used,
+    each for at most ttl seconds if given. Results are stored and returned
+    as copies made with copy (copy.deepcopy by default; dict is
+    enough when field values are immutable), so that callers never share
+    a dictionary they could corrupt for each other
+    """
+
+    def __init__(self, key, max_size=1024, ttl=None, copy=copy.deepcopy):
+        self.key = key
+        self.max_size = max_size
+        self.ttl = ttl
+        self.copy = copy
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, entity, projection):
+        """
+        Returns the key of entity and a copy of its cached result
+        for projection, or MISSING if there is none
+        """
+        key = self.key(entity._o, entity._AUX_OBJECTS_)
+        if key is None:
+            return None, MISSING
+
+        projection = (type(entity),) + projection
+        now = timer()
+
+        with self.lock:
+            result = MISSING
+            renders = self.entries.pop(key, None)
+            if renders is not None:
+                # most recently used last
+                self.entries[key] = renders
+
+                expires, result = renders.get(projection, (None, MISSING))
+                if expires is not None and expires <= now:
+                    del renders[projection]
+                    result = MISSING
+
+            if result is MISSING:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        if result is MISSING:
+            return key, MISSING
+        return key, self.copy(result)
+
+    def store(self, key, entity, projection, result):
+        """
+        Caches a copy of result, the render of entity for projection,
+        under key as returned by lookup (nothing if that was None)
+        """
+        if key is None:
+            return
+
+        projection = (type(entity),) + projection
+        stored = self.copy(result)
+        expires = None if self.ttl is None else timer() + self.ttl
+
+        with self.lock:
+            self.entries.setdefault(key, {})[projection] = (expires, stored)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def fetch(self, entity, projection, render):
+        """
+        Returns the cached result of entity for projection,
+        or calls render and caches its result
+        """
+        key, result = self.lookup(entity, projection)
+        if result is MISSING:
+            result = render()
+            self.store(key, entity, projection, result)
+        return result
+
+    def wrap(self, render, projection):
+        """
+        Returns a version of render, a function of an entity,
+        going through the cache
+        """
+        def render_cached(entity):
+            return self.fetch(entity, projection, lambda: render(entity))
+        return render_cached
+
+    def invalidate(self, *keys):
+        """
+        Forgets the results cached under keys (all of them if none are given)
+        """
+        with self.lock:
+            if keys:
+                for key in keys:
+                    self.entries.pop(key, None)
+            else:
+                self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {
+                'hits' : self.hits,
+                'misses' : self.misses,
+                'size' : len(self.entries),
+            }
+
+
+# what Entity.diff renders an entity against: the dictionary the entity
+# rendered to, and the versions of its _VERSIONS_ fields at the time
+Snapshot = collections.namedtuple('Snapshot', ['values', 'versions'])
+
+
+class EntityPlan(object):
+    """
+    The validated configuration of a single Entity class
+
+    Built once by EntityMeta when the class is created, so that
+    configuration errors surface at class definition time and
+    Entity.__init__ only has to bind the object and the aux objects
+
+    It also resolves every field once into a (field, kind, value)
+    resolution table, so that rendering never has to walk the
+    Entity base classes
+    """
+
+    __slots__ = (
+        'alias',
+        'fields',
+        'aux_objects',
+        'resolution',
+        'lookup',
+        'batched',
+        'io',
+        'compiled',
+        'compiled_row',
+        'encoder',
+        'projections',
+        'prefetch',
+        'proxies',
+        'versioned',
+        'versions',
+        'state_slots',
+    )
+
+    def __init__(self, klass):
 
         # copy this down
         _ALIAS_ = klass._ALIAS_
 
         if _ALIAS_ is not None:
-            if not isinstance(_ALIAS_, basestring):
+            if not isinstance(_ALIAS_, string_types):
                 raise ValueError('_ALIAS_ %r must be a basestring' % _ALIAS_)
             if not is_legal_identifier(_ALIAS_):
                 raise ValueError('_ALIAS_ %r must be a legal identifier' % _ALIAS_)
 
-            setattr(self, _ALIAS_, obj)
-
         # copy this down
         _FIELDS_ = klass._FIELDS_
         if _FIELDS_ is None:
@@ -49,7 +667,7 @@ class Entity(object):
 
         for field in _FIELDS_:
             # assert there's no collisions
-            if field in BOOTSTRAP_ATTRS:
+            if field in RESERVED_ATTRS:
                 raise ValueError("Collision in %s with reserved attribute name %s" % (
                     klass.__name__,
                     field,
@@ -64,6 +682,12 @@ class Entity(object):
             if field.startswith('__'):
                 raise ValueError("Fields cannot begin with double underscore")
 
+            if DUNDER_MANGLE_RE.match(field):
+                raise ValueError("Field %s in %s is a mangled Entity name" % (
+                    field,
+                    klass.__name__,
+                ))
+
         # copy this down
         _AUX_OBJECTS_ = klass._AUX_OBJECTS_
         if _AUX_OBJECTS_ is None:
@@ -77,7 +701,7 @@ class Entity(object):
             # - not reserved
             # - doesn't collide with _FIELDS_
             # - doesn't collid with _ALIAS_
-            if aux_object_name in BOOTSTRAP_ATTRS:
+            if aux_object_name in RESERVED_ATTRS:
                 raise ValueError("Collision in %s with reserved attribute name %s and aux object" % (
                     klass.__name__,
                     aux_object_name,
@@ -101,148 +725,1452 @@ class Entity(object):
             if not is_legal_identifier(aux_object_name):
                 raise ValueError("aux object %s is not a legal identifier" % aux_object_name)
 
-        _AUX_OBJECTS_ = set(_AUX_OBJECTS_)
-        aux_dict = {}
-        received_aux_objects = set()
+            if aux_object_name in RENDER_OPTIONS:
+                raise ValueError("Collision in %s with render option %s and aux object" % (
+                    klass.__name__,
+                    aux_object_name,
+                ))
 
-        for k, v in kwargs.items():
-            if k in _AUX_OBJECTS_:
-                aux_dict[k] = v
-            else:
-                raise TypeError("Unexpected aux object: %s" % k)
+        if not klass._CACHE_ is None and not isinstance(klass._CACHE_, RenderCache):
+            raise ValueError("_CACHE_ of %s must be a RenderCache" % klass.__name__)
 
-            received_aux_objects.add(k)
+        # copy this down
+        _PREFETCH_ = klass._PREFETCH_
+        if _PREFETCH_ is None:
+            _PREFETCH_ = []
 
-        missing = _AUX_OBJECTS_ - received_aux_objects
-        if missing:
-            raise TypeError("Missing aux object: %s" % missing.pop())
+        if not isinstance(_PREFETCH_, (list, tuple)):
+            raise ValueError("_PREFETCH_ must be a list")
 
-        # store these away
-        self._o = obj
-        self._ALIAS_ = _ALIAS_
-        self._FIELDS_ = _FIELDS_
+        for related in _PREFETCH_:
+            if not isinstance(related, string_types):
+                raise ValueError("_PREFETCH_ entry %r of %s must be a basestring" % (
+                    related,
+                    klass.__name__,
+                ))
 
-        self._AUX_OBJECTS_ = aux_dict
+        if _PREFETCH_ and klass.prefetch.__func__ is Entity.prefetch.__func__:
+            raise ValueError("%s has _PREFETCH_ but no prefetch hook" % klass.__name__)
 
-    def __reset_inner(self):
-        """
-        Clears out the inner dictionary, then fills it
-        by calling __resolve_attr on all the fields in _FIELDS_
+        self.prefetch = tuple(_PREFETCH_)
 
-        If SuppressField is thrown for any field, that field is not
-        added to the dictionary
-        """
-        new_inner = {}
-        for field in self._FIELDS_:
-            try:
-                value = self.__resolve_attr(field)
-            except SuppressField:
-                pass
-            else:
-                new_inner[field] = value
+        if not klass._SOURCE_ in (None, 'attributes', 'items'):
+            raise ValueError("_SOURCE_ of %s must be 'attributes' or 'items'" % klass.__name__)
 
-        self.__inner = new_inner
+        proxy_kind = ITEM_FIELD if klass._SOURCE_ == 'items' else PROXY_FIELD
 
-    def __resolve_attr(self, attr):
-        """
-        Resolves an Attribute
-         - if it is __dunder__, call object.__getattribute__
-         - if it is __Mangled_method, call object.__getattribute__
-         - if it a bootstrap attribute (_FIELDS_, _ALIAS_, _o, _AUX_OBJECTS_), return it from __dict__
-         - if _ALIAS_ is set and the attribute is that alias, return the _o wrapped object
-         - if the attribute is in _AUX_OBJECTS_, return it
+        # copy this down
+        _VERSIONS_ = klass._VERSIONS_
+        if _VERSIONS_ is None:
+            _VERSIONS_ = {}
 
-         - assert that it is a valid Field (in _FIELDS_)
-         - recursively check this and base classes for its presence using __getattr_from_class
-         - try and proxy it the _o wrapped object
-         - if a callable, call it
+        if not isinstance(_VERSIONS_, dict):
+            raise ValueError("_VERSIONS_ must be a dict")
 
-        Throws an AttributeError if ultimately unable to find it
-        Can also throw a SuppressField exception if we want to suppress that field
-        """
-        # dunders and mangled get sent through
-        if DUNDER_MANGLE_RE.match(attr):
-            return object.__getattribute__(self, attr)
+        self.versioned = {}
+        for field, name in _VERSIONS_.items():
+            if not field in _FIELDS_:
+                raise ValueError("_VERSIONS_ of %s has unknown field %s" % (klass.__name__, field))
 
-        # save these to avoid calls to __getattribute__
-        # have to be above the dunder handling!
-        __dict__ = self.__dict__
-        klass = self.__class__
+            try:
+                version = self.find_class_attr(klass, name)
+            except (AttributeError, TypeError):
+                version = None
+            if not callable(version):
+                raise ValueError("Version %r of field %s in %s is not a method" % (
+                    name,
+                    field,
+                    klass.__name__,
+                ))
 
-        # bootstrap
-        if attr in BOOTSTRAP_ATTRS:
-            return __dict__[attr]
+            self.versioned[field] = version
 
-        # load as local to save a recursive call to __getattribute__
-        _ALIAS_, _FIELDS_, _o, _AUX_OBJECTS_ = [__dict__[a] for a in BOOTSTRAP_ATTRS]
+        self.alias = _ALIAS_
+        self.fields = _FIELDS_
+        self.aux_objects = frozenset(_AUX_OBJECTS_)
 
-        if _ALIAS_:
-            if attr == _ALIAS_:
-                return _o
+        resolution = []
+        for field in _FIELDS_:
+            try:
+                value = self.find_class_attr(klass, field)
+            except AttributeError:
+                resolution.append((field, proxy_kind, None))
+            else:
+                if isinstance(value, batched):
+                    resolution.append((field, BATCHED_FIELD, value.func))
+                elif isinstance(value, io_bound):
+                    resolution.append((field, IO_FIELD, value.func))
+                elif callable(value):
+                    resolution.append((field, METHOD_FIELD, value))
+                else:
+                    resolution.append((field, CONSTANT_FIELD, value))
 
-        if attr in _AUX_OBJECTS_:
-            return _AUX_OBJECTS_[attr]
+        self.lookup = dict((field, (kind, value)) for field, kind, value in resolution)
+        self.projections = {}
+        self.state_slots = self.find_state_slots(klass)
+        self.use_resolution(klass, resolution)
 
-        if not attr in _FIELDS_:
-            raise AttributeError('Entity %s has no field %s' % (
-                klass.__name__,
-                attr,
-            ))
+    def use_resolution(self, klass, resolution):
+        """
+        Sets the resolution table of the plan, the fields it renders
+        and everything derived from them
+        """
+        self.resolution = tuple(resolution)
+        self.fields = tuple(field for field, kind, value in resolution)
+        self.batched = tuple(
+            (field, value) for field, kind, value in resolution
+            if kind is BATCHED_FIELD
+        )
+        self.io = tuple(
+            (field, value) for field, kind, value in resolution
+            if kind is IO_FIELD
+        )
+        self.versions = tuple(
+            (field, self.versioned[field]) for field in self.fields
+            if field in self.versioned
+        )
 
-        # Get the field!
-        try:
-            # try to get it from this klass or any Entity base classes
-            value = self.__getattr_from_class(klass, attr)
-        except AttributeError:
-            # fine. try to proxy it then
-            try:
-                value = getattr(_o, attr)
-            except AttributeError:
-                raise AttributeError("Cannot find a value for attribute %r in %s" % (
-                    attr,
-                    klass.__name__,
-                ))
+        # look up all the fields read by key at once, see fill_proxies
+        # (attributes are read one at a time, in order, as they may be
+        # properties with side effects)
+        names = tuple(field for field, kind, value in resolution if kind is ITEM_FIELD)
+        if len(names) < 2:
+            self.proxies = None
+        else:
+            self.proxies = (names, operator.itemgetter(*names))
 
-        if callable(value):
-            return value()
+        if klass._COMPILED_:
+            self.compiled = compile_render(klass, self.resolution, DICT_OUTPUT)
+            self.compiled_row = compile_render(klass, self.resolution, ROW_OUTPUT)
         else:
-            return value
+            self.compiled = None
+            self.compiled_row = None
+
+        # every class gets one, compiled on first use, see renderer
+        self.encoder = None
 
-    def __getattr_from_class(self, klass, attr):
+    def project(self, klass, only=None, exclude=None):
         """
-        Check for attr in the __dict__ of klass
-        If found,
-            if it's a callable, bind self to it and return it (bootleg bound method)
-            otherwise just return it
+        Returns a plan rendering only the fields in only (all of them if None)
+        that are not in exclude, still in the order of _FIELDS_
 
-        Otherwise, call this method recursively on any Entity-subclasses that
-        are a baseclass of klass.
+        Attribute access still sees every field, so a field method can
+        read a field that is not rendered. Projections are cached, so
+        rendering the same one again costs nothing extra
 
-        Will raise AttributeError if unable to find attr anywhere.
+        Throws a ValueError for a field that the class does not have
         """
+        key = projection_key(only, exclude)
         try:
-            # look it up this class
-            value = klass.__dict__[attr]
+            return self.projections[key]
         except KeyError:
             pass
-        else:
-            if callable(value):
-                return lambda : value(self)
-            else:
-                return value
 
-        # here if not in klass
-        # im also willing to look it up in base
-        # class that is an Entity! (recursion YAY)
-        for base_klass in klass.__bases__:
-            if issubclass(base_klass, Entity) and not base_klass is Entity:
+        for fields in key:
+            for field in fields or ():
+                if not field in self.lookup:
+                    raise ValueError("Unknown field %s in %s" % (field, klass.__name__))
+
+        only, exclude = key
+        resolution = [
+            (field, kind, value) for field, kind, value in self.resolution
+            if (only is None or field in only) and not (exclude and field in exclude)
+        ]
+
+        projection = object.__new__(EntityPlan)
+        projection.alias = self.alias
+        projection.aux_objects = self.aux_objects
+        projection.lookup = self.lookup
+        projection.prefetch = self.prefetch
+        projection.versioned = self.versioned
+        projection.projections = None
+        projection.use_resolution(klass, resolution)
+
+        # callers can send any number of distinct projections
+        if len(self.projections) < MAX_PROJECTIONS:
+            self.projections[key] = projection
+        return projection
+
+    def check_aux_objects(self, aux):
+        """
+        Checks that the dictionary aux has exactly the aux objects of the class
+
+        Throws a TypeError for an unexpected or missing aux object
+        """
+        aux_objects = self.aux_objects
+
+        for k in aux:
+            if not k in aux_objects:
+                raise TypeError("Unexpected aux object: %s" % k)
+
+        if len(aux) != len(aux_objects):
+            missing = aux_objects.difference(aux)
+            raise TypeError("Missing aux object: %s" % next(iter(missing)))
+
+    def fill_batches(self, klass, entities):
+        """
+        Calls every batched field once for the batch of entities
+        and seeds the memo of each entity with its own values
+
+        A batched field raising SuppressField suppresses it for the whole batch.
+        Suppressed values are memoized as SUPPRESS
+        """
+        batches = [{} for entity in entities]
+
+        for field, func in self.batched:
+            try:
+                if instrumentation is None:
+                    values = func(klass, entities)
+                else:
+                    values = instrumentation.call(klass, field, BATCHED_FIELD, func, klass, entities)
+            except SuppressField:
+                values = [SUPPRESS] * len(entities)
+
+            if len(values) != len(entities):
+                raise ValueError("Batched field %s in %s returned %d values for %d entities" % (
+                    field,
+                    klass.__name__,
+                    len(values),
+                    len(entities),
+                ))
+
+            for batch, value in zip(batches, values):
+                if is_suppressed(value):
+                    value = SUPPRESS
+                batch[field] = value
+
+        for entity, batch in zip(entities, batches):
+            memo = object.__getattribute__(entity, '_Entity__memo')
+            if memo is None:
+                entity._Entity__memo = batch
+            else:
+                memo.update(batch)
+
+    def run_prefetch(self, klass, entities):
+        """
+        Calls the prefetch hook of klass once for the batch of entities,
+        and returns the dictionary of related data of each entity
+
+        The hook returns a dictionary of each related name in _PREFETCH_
+        to a list of one value per entity, or None if it loaded
+        the related data onto the wrapped objects themselves
+        """
+        related = klass.prefetch(entities, self.prefetch)
+        if related is None:
+            related = {}
+
+        contexts = [{} for entity in entities]
+        for name, values in related.items():
+            if len(values) != len(entities):
+                raise ValueError("Prefetch of %s in %s returned %d values for %d entities" % (
+                    name,
+                    klass.__name__,
+                    len(values),
+                    len(entities),
+                ))
+
+            for context, value in zip(contexts, values):
+                context[name] = value
+
+        return contexts
+
+    def fill_prefetch(self, klass, entities):
+        """
+        Runs the prefetch hook for the batch of entities,
+        and seeds the memo of each entity with its related data
+        """
+        contexts = self.run_prefetch(klass, entities)
+
+        for entity, context in zip(entities, contexts):
+            memo = object.__getattribute__(entity, '_Entity__memo')
+            if memo is None:
+                memo = entity._Entity__memo = {}
+            memo[PREFETCHED] = context
+
+    def fill_proxies(self, entity, memo):
+        """
+        Looks up every field of entity read by key ('items' sources)
+        in one call to the itemgetter of the plan and memoizes their values
+
+        Everything is left to resolve_field if the getter throws,
+        so that the error comes from the field that caused it
+
+        So is everything, too, if any of them is already in the memo
+        (as seeded by Entity.diff), so that it is not looked up again
+        """
+        names, getter = self.proxies
+        if memo:
+            for field in names:
+                if field in memo:
+                    return
+
+        try:
+            values = getter(object.__getattribute__(entity, '_o'))
+        except Exception:
+            return
+
+        memo.update(zip(names, values))
+
+    def get_versions(self, entity):
+        """
+        Returns the dictionary of the version of each versioned field
+        of entity, calling each version method once
+        """
+        versions = {}
+        computed = {}
+        for field, version in self.versions:
+            try:
+                versions[field] = computed[version]
+            except KeyError:
+                versions[field] = computed[version] = version(entity)
+        return versions
+
+    def fill_io(self, entities, timeout=None):
+        """
+        Calls every I/O-bound field of every entity in the shared io_pool
+        and seeds the memo of each entity with its values
+
+        Waits for them at most timeout seconds in all if given, then throws
+        concurrent.futures.TimeoutError. A field returning SUPPRESS or
+        throwing SuppressField is suppressed, any other exception is
+        thrown again: that of the first failing field of the first
+        failing entity, in order, whatever order they failed in.
+        Fields that have not started by then are cancelled
+
+        Called from a thread of the io_pool, as when an I/O-bound field
+        renders nested entities, the fields are called right there instead,
+        in order and without timeout: waiting on the pool from its own
+        threads could leave no thread free to run what they wait for
+        """
+        inline = getattr(io_thread, 'in_pool', False)
+        if not inline:
+            pool = io_pool()
+
+        submitted = []
+        for entity in entities:
+            memo = object.__getattribute__(entity, '_Entity__memo')
+            if memo is None:
+                memo = entity._Entity__memo = {}
+
+            for field, func in self.io:
+                # seeded by Entity.diff
+                if field in memo:
+                    continue
+
+                if instrumentation is None:
+                    call = (func, entity)
+                else:
+                    call = (instrumentation.call, type(entity), field, IO_FIELD, func, entity)
+
+                if inline:
+                    try:
+                        memo[field] = call[0](*call[1:])
+                    except SuppressField:
+                        memo[field] = SUPPRESS
+                else:
+                    submitted.append((memo, field, pool.submit(call_io_field, *call)))
+
+        if timeout is not None:
+            deadline = time.time() + timeout
+
+        try:
+            for memo, field, future in submitted:
+                if timeout is not None:
+                    timeout = max(0, deadline - time.time())
+
                 try:
-                    return self.__getattr_from_class(base_klass, attr)
+                    memo[field] = future.result(timeout)
+                except SuppressField:
+                    memo[field] = SUPPRESS
+        finally:
+            for memo, field, future in submitted:
+                future.cancel()
+
+    def renderer(self, klass, output=DICT_OUTPUT):
+        """
+        Returns the function rendering an entity of klass into output:
+        the compiled render if there is one, render otherwise
+        (for ROW_OUTPUT, compiled_row or render_row)
+
+        For JSON_OUTPUT it is the encoder, compiled for the plan the first
+        time it is needed whether or not the class is _COMPILED_
+
+        Compiled renders inline their fields, so render (or render_json)
+        is used instead while instrumentation is enabled
+        """
+        if output is JSON_OUTPUT:
+            if instrumentation is not None:
+                return self.render_json
+            if self.encoder is None:
+                self.encoder = compile_render(klass, self.resolution, JSON_OUTPUT)
+            return self.encoder
+
+        if self.compiled is None or instrumentation is not None:
+            if output is ROW_OUTPUT:
+                return self.render_row
+            return self.render
+
+        if output is ROW_OUTPUT:
+            return self.compiled_row
+        return self.compiled
+
+    def render(self, entity):
+        """
+        Builds the dictionary for entity by resolving
+        all the fields in the resolution table
+
+        If any field returns SUPPRESS or throws SuppressField,
+        that field is not added to the dictionary
+
+        Field values are memoized for the duration of the render, so a field
+        that reads another field through the entity reuses its value.
+        The memo is dropped once the render is done, unless it was
+        already there when the render started (as seeded by fill_batches).
+        Proxied fields are looked up all at once first, see fill_proxies
+        """
+        memo = object.__getattribute__(entity, '_Entity__memo')
+        owner = memo is None
+        if owner:
+            memo = entity._Entity__memo = {}
+
+        # instrumentation times each proxied field on its own
+        if self.proxies is not None and instrumentation is None:
+            self.fill_proxies(entity, memo)
+
+        try:
+            result = {}
+            for field, kind, value in self.resolution:
+                try:
+                    field_value = memo[field]
+                except KeyError:
+                    try:
+                        field_value = resolve_field(entity, field, kind, value)
+                    except SuppressField:
+                        field_value = SUPPRESS
+                    memo[field] = field_value
+
+                if field_value is not SUPPRESS:
+                    result[field] = field_value
+
+            return result
+        finally:
+            if owner:
+                entity._Entity__memo = None
+
+    def render_row(self, entity):
+        """
+        Like render, but builds a tuple of the values of the fields
+        in the order of the resolution table, with SUPPRESS
+        in place of suppressed fields
+        """
+        memo = object.__getattribute__(entity, '_Entity__memo')
+        owner = memo is None
+        if owner:
+            memo = entity._Entity__memo = {}
+
+        # instrumentation times each proxied field on its own
+        if self.proxies is not None and instrumentation is None:
+            self.fill_proxies(entity, memo)
+
+        try:
+            row = []
+            for field, kind, value in self.resolution:
+                try:
+                    field_value = memo[field]
+                except KeyError:
+                    try:
+                        field_value = resolve_field(entity, field, kind, value)
+                    except SuppressField:
+                        field_value = SUPPRESS
+                    memo[field] = field_value
+
+                row.append(field_value)
+
+            return tuple(row)
+        finally:
+            if owner:
+                entity._Entity__memo = None
+
+    def render_json(self, entity):
+        """
+        Like render, but encodes the fields as a JSON object
+        in UTF-8 bytes, see encode_row
+        """
+        return encode_row(self.fields, self.render_row(entity))
+
+    @classmethod
+    def find_state_slots(cls, klass):
+        """
+        Returns the (mangled) names of the slots that the Entity
+        subclasses in the hierarchy of klass declare, where field
+        methods can keep state on slotted entities
+        """
+        names = []
+        for base_klass in klass.__mro__:
+            if not isinstance(base_klass, EntityMeta):
+                continue
+
+            slots = base_klass.__dict__.get('__slots__', ())
+            if isinstance(slots, string_types):
+                slots = [slots]
+
+            for name in slots:
+                if name in ('__dict__', '__weakref__'):
+                    continue
+                if name.startswith('__') and not name.endswith('__'):
+                    name = '_%s%s' % (base_klass.__name__.lstrip('_'), name)
+                # the slots of Entity itself
+                if name in BOOTSTRAP_ATTRS or DUNDER_MANGLE_RE.match(name):
+                    continue
+                names.append(name)
+
+        return tuple(names)
+
+    @classmethod
+    def find_class_attr(cls, klass, attr):
+        """
+        Check for attr in the __dict__ of klass
+        If found, return it (or what an EntityDescriptor replaced, if anything)
+
+        Otherwise, call this method recursively on any Entity-subclasses that
+        are a baseclass of klass.
+
+        Will raise AttributeError if unable to find attr anywhere.
+        """
+        try:
+            # look it up this class
+            value = klass.__dict__[attr]
+        except KeyError:
+            pass
+        else:
+            # see through the descriptors of _DESCRIPTORS_ classes
+            if isinstance(value, EntityDescriptor):
+                value = value.source
+            if not value is MISSING:
+                return value
+
+        # here if not in klass
+        # im also willing to look it up in base
+        # class that is an Entity! (recursion YAY)
+        for base_klass in klass.__bases__:
+            if issubclass(base_klass, Entity) and not base_klass is Entity:
+                try:
+                    return cls.find_class_attr(base_klass, attr)
                 except AttributeError:
                     pass
 
         raise AttributeError
 
+
+# literal types that compile_render can inline as constants
+INLINE_TYPES = string_types + integer_types + (bool, type(None))
+
+# how the JSON encoder of compile_render recognizes text, with t its type
+if text_type is str:
+    STRING_CHECK = 't is str'
+else:
+    STRING_CHECK = 't is str or t is text_type'
+
+def compile_render(klass, resolution, output=DICT_OUTPUT):
+    """
+    Generates and compiles a render function specialized to
+    the resolution table of klass
+
+    The function takes an entity and returns the same dictionary as
+    calling the entity through the generic path (for ROW_OUTPUT, the same
+    tuple as EntityPlan.render_row, and for JSON_OUTPUT, the same bytes
+    as EntityPlan.render_json), in straight-line code:
+     - literal constants are inlined, other constants are bound by name
+     - methods (I/O-bound or not) are called directly with the entity
+     - proxies call getattr on the wrapped object directly,
+       items subscript the wrapped mapping or row directly
+     - batched methods go through resolve_field
+     - each method and proxy field catches its own SuppressField,
+       a constant SUPPRESS leaves its field out
+
+    and memoizes field values for the render like EntityPlan.render
+
+    The JSON encoder writes the fields straight into the JSON object,
+    with their keys escaped once here, and constants encoded once here too.
+    Text and int values are encoded inline, RawJSON values are spliced
+    in, and anything else goes through encode_json
+    """
+    namespace = {
+        'SuppressField' : SuppressField,
+        'raise_missing_field' : raise_missing_field,
+        'resolve_field' : resolve_field,
+        'BATCHED_FIELD' : BATCHED_FIELD,
+        'SUPPRESS' : SUPPRESS,
+        'callable' : callable,
+        'getattr' : getattr,
+        'object_getattribute' : object.__getattribute__,
+        'type' : type,
+        'str' : str,
+        'text_type' : text_type,
+        'int' : int,
+        'int_repr' : int.__repr__,
+        'RawJSON' : RawJSON,
+        'encode_string' : encode_string,
+        'encode_json' : encode_json,
+    }
+
+    lines = [
+        'def render(entity):',
+        '    _o = object_getattribute(entity, "_o")',
+        '    memo = object_getattribute(entity, "_Entity__memo")',
+        '    owner = memo is None',
+        '    if owner:',
+        '        memo = entity._Entity__memo = {}',
+        '    try:',
+    ]
+    if output is DICT_OUTPUT:
+        lines.append('        result = {}')
+    elif output is JSON_OUTPUT:
+        lines.extend([
+            '        parts = []',
+            '        append = parts.append',
+        ])
+
+    for i, (field, kind, value) in enumerate(resolution):
+        # where the value of the field goes
+        if output is ROW_OUTPUT:
+            target = '_v%d' % i
+        else:
+            target = 'result[%r]' % field
+
+        if kind is CONSTANT_FIELD and output is JSON_OUTPUT:
+            if not value is SUPPRESS:
+                name = '_c%d' % i
+                if isinstance(value, RawJSON):
+                    encoded = value.text()
+                else:
+                    encoded = encode_json(value)
+                namespace[name] = encode_string(field) + ':' + encoded
+                lines.append('        append(%s)' % name)
+            continue
+
+        if kind is CONSTANT_FIELD:
+            if value is SUPPRESS:
+                if output is ROW_OUTPUT:
+                    lines.append('        %s = SUPPRESS' % target)
+            elif type(value) in INLINE_TYPES:
+                lines.append('        %s = %r' % (target, value))
+            else:
+                name = '_c%d' % i
+                namespace[name] = value
+                lines.append('        %s = %s' % (target, name))
+            continue
+
+        lines.extend([
+            '        if %r in memo:' % field,
+            '            value = memo[%r]' % field,
+            '        else:',
+            '            try:',
+        ])
+
+        if kind is BATCHED_FIELD:
+            name = '_b%d' % i
+            namespace[name] = value
+            lines.append(
+                '                value = resolve_field(entity, %r, BATCHED_FIELD, %s)' % (field, name),
+            )
+
+        elif kind is METHOD_FIELD or kind is IO_FIELD:
+            name = '_m%d' % i
+            namespace[name] = value
+            lines.append(
+                '                value = %s(entity)' % name,
+            )
+
+        elif kind is ITEM_FIELD:
+            lines.extend([
+                '                try:',
+                '                    value = _o[%r]' % field,
+                '                except (KeyError, IndexError):',
+                '                    raise_missing_field(entity, %r)' % field,
+            ])
+
+        else:
+            lines.extend([
+                '                try:',
+                '                    value = getattr(_o, %r)' % field,
+                '                except AttributeError:',
+                '                    raise_missing_field(entity, %r)' % field,
+                '                if callable(value):',
+                '                    value = value()',
+            ])
+
+        lines.extend([
+            '            except SuppressField:',
+            '                value = SUPPRESS',
+            '            memo[%r] = value' % field,
+        ])
+
+        if output is ROW_OUTPUT:
+            lines.append('        %s = value' % target)
+        elif output is DICT_OUTPUT:
+            lines.extend([
+                '        if value is not SUPPRESS:',
+                '            %s = value' % target,
+            ])
+        else:
+            name = '_k%d' % i
+            namespace[name] = encode_string(field) + ':'
+            lines.extend([
+                '        if value is not SUPPRESS:',
+                '            t = type(value)',
+                '            if %s:' % STRING_CHECK,
+                '                append(%s + encode_string(value))' % name,
+                '            elif t is int:',
+                '                append(%s + int_repr(value))' % name,
+                '            elif t is RawJSON:',
+                '                append(%s + value.text())' % name,
+                '            else:',
+                '                append(%s + encode_json(value))' % name,
+            ])
+
+    if output is ROW_OUTPUT:
+        lines.append('        return (%s)' % ''.join('_v%d, ' % i for i in range(len(resolution))))
+    elif output is DICT_OUTPUT:
+        lines.append('        return result')
+    else:
+        lines.append("        return ('{' + ','.join(parts) + '}').encode('utf-8')")
+
+    lines.extend([
+        '    finally:',
+        '        if owner:',
+        '            entity._Entity__memo = None',
+    ])
+    source = '\n'.join(lines) + '\n'
+
+    code = compile(source, '<pyentity render of %s>' % klass.__name__, 'exec')
+    exec(code, namespace)
+
+    render = namespace['render']
+    render.source = source
+    return render
+
+
+# what an EntityDescriptor replaced when there was nothing there
+MISSING = object()
+
+class EntityDescriptor(object):
+    """
+    Base of the data descriptors that _DESCRIPTORS_ classes get
+    for their fields, alias and aux objects
+
+    They are read only, and remember what they replaced in the class
+    __dict__ as source, so that EntityPlan.find_class_attr still finds it
+    """
+
+    __slots__ = ('name', 'source')
+
+    def __init__(self, name, source=MISSING):
+        self.name = name
+        self.source = source
+
+    def __set__(self, entity, value):
+        raise AttributeError("Cannot set %s of %s" % (
+            self.name,
+            type(entity).__name__,
+        ))
+
+    def no_field(self, entity):
+        return AttributeError('Entity %s has no field %s' % (
+            type(entity).__name__,
+            self.name,
+        ))
+
+
+class FieldDescriptor(EntityDescriptor):
+    """
+    Resolves a field through the plan of the class of the entity,
+    memoized if this happens during a render
+    """
+
+    __slots__ = ()
+
+    def __get__(self, entity, owner):
+        if entity is None:
+            return self
+
+        field = self.name
+        try:
+            kind, value = type(entity)._Entity__plan.lookup[field]
+        except KeyError:
+            # a field of a base class, but not of this one
+            raise self.no_field(entity)
+
+        try:
+            memo = entity._Entity__memo
+            if memo is None:
+                return resolve_unmemoized(entity, field, kind, value)
+            else:
+                return resolve_memoized(entity, memo, field, kind, value)
+        except SuppressField:
+            raise AttributeError("Field %s is suppressed in %s" % (
+                field,
+                type(entity).__name__,
+            ))
+
+
+class AliasDescriptor(EntityDescriptor):
+    """
+    Returns the wrapped object
+    """
+
+    __slots__ = ()
+
+    def __get__(self, entity, owner):
+        if entity is None:
+            return self
+        if not type(entity)._Entity__plan.alias == self.name:
+            raise self.no_field(entity)
+        return entity._o
+
+
+class AuxObjectDescriptor(EntityDescriptor):
+    """
+    Returns one of the aux objects
+    """
+
+    __slots__ = ()
+
+    def __get__(self, entity, owner):
+        if entity is None:
+            return self
+        try:
+            return entity._Entity__aux[self.name]
+        except KeyError:
+            raise self.no_field(entity)
+
+
+class AuxObjectsDescriptor(EntityDescriptor):
+    """
+    Returns the aux objects dictionary from an entity,
+    and the _AUX_OBJECTS_ configuration from the class
+    """
+
+    __slots__ = ()
+
+    def __get__(self, entity, owner):
+        if entity is None:
+            return self.source
+        return entity._Entity__aux
+
+
+class HiddenDescriptor(EntityDescriptor):
+    """
+    Hides a class attribute that is not a field from entities, as
+    Entity.__resolve_attr does, while the class itself still reads it
+    """
+
+    __slots__ = ()
+
+    def __get__(self, entity, owner):
+        if entity is not None:
+            raise self.no_field(entity)
+
+        for base_klass in owner.__mro__:
+            try:
+                value = base_klass.__dict__[self.name]
+            except KeyError:
+                continue
+            if isinstance(value, EntityDescriptor):
+                value = value.source
+                if value is MISSING:
+                    continue
+            if hasattr(type(value), '__get__'):
+                return value.__get__(None, owner)
+            return value
+
+        raise AttributeError(self.name)
+
+
+def install_descriptors(klass):
+    """
+    Puts an EntityDescriptor on klass for each of its fields, its alias,
+    each of its aux objects and _AUX_OBJECTS_, and lets instances
+    use the plain object.__getattribute__, so that attribute access
+    runs at normal Python speed instead of going through Entity.__resolve_attr
+
+    Every other attribute of the Entity subclasses (and mixins) of klass
+    is hidden from the entities behind a HiddenDescriptor, except for
+    dunders, the slots they declare and the attributes of Entity itself
+    """
+    plan = klass._Entity__plan
+    __dict__ = klass.__dict__
+
+    visible = set(plan.fields)
+    visible.update(plan.aux_objects)
+    visible.update(BOOTSTRAP_ATTRS)
+    visible.update(Entity.__dict__)
+    if plan.alias:
+        visible.add(plan.alias)
+
+    for base_klass in klass.__mro__:
+        if base_klass is Entity or base_klass is object:
+            continue
+        for name, value in list(base_klass.__dict__.items()):
+            if name in visible or DUNDER_MANGLE_RE.match(name):
+                continue
+            visible.add(name)
+            if isinstance(value, (EntityDescriptor, types.MemberDescriptorType)):
+                continue
+            setattr(klass, name, HiddenDescriptor(name, __dict__.get(name, MISSING)))
+
+    for field in plan.fields:
+        setattr(klass, field, FieldDescriptor(field, __dict__.get(field, MISSING)))
+
+    if plan.alias:
+        setattr(klass, plan.alias, AliasDescriptor(plan.alias, __dict__.get(plan.alias, MISSING)))
+
+    for aux_object_name in plan.aux_objects:
+        setattr(klass, aux_object_name, AuxObjectDescriptor(
+            aux_object_name,
+            __dict__.get(aux_object_name, MISSING),
+        ))
+
+    klass._AUX_OBJECTS_ = AuxObjectsDescriptor('_AUX_OBJECTS_', klass._AUX_OBJECTS_)
+    klass.__getattribute__ = object.__getattribute__
+
+
+class EntityMeta(type):
+    """
+    Metaclass of Entity
+
+    Validates the configuration of every Entity class as it is created
+    and stores the resulting EntityPlan on it
+
+    Subclasses of a slotted Entity class (other than Entity itself)
+    are given empty __slots__ unless they declare their own,
+    so that their instances stay without a __dict__
+
+    Classes with _DESCRIPTORS_ set get their descriptors installed
+    """
+
+    def __new__(meta, name, bases, dct):
+        if not '__slots__' in dct:
+            for base in bases:
+                if isinstance(base, EntityMeta) and not base is Entity and base.__dictoffset__ == 0:
+                    dct['__slots__'] = ()
+                    break
+
+        return super(EntityMeta, meta).__new__(meta, name, bases, dct)
+
+    def __init__(klass, name, bases, dct):
+        super(EntityMeta, klass).__init__(name, bases, dct)
+        klass._Entity__plan = EntityPlan(klass)
+
+        if klass._DESCRIPTORS_:
+            install_descriptors(klass)
+        elif klass.__getattribute__ is object.__getattribute__:
+            # a subclass turning _DESCRIPTORS_ back off
+            klass.__getattribute__ = Entity.__dict__['__getattribute__']
+
+
+@add_metaclass(EntityMeta)
+class Entity(object):
+
+    # the only per-instance state: the wrapped object, the aux objects
+    # and the memo of the current render. Everything else is read from the class
+    __slots__ = ('_o', '_Entity__aux', '_Entity__memo')
+
+    # list of fields to present
+    _FIELDS_ = None
+
+    # alias for the wrapped object `_o`
+    _ALIAS_ = None
+
+    # list of required aux objects
+    _AUX_OBJECTS_ = None
+
+    # whether to render through a generated function, see compile_render
+    _COMPILED_ = False
+
+    # how many entities bulk rendering hands to batched fields,
+    # or submits the I/O-bound fields of, at once
+    _BATCH_SIZE_ = 1000
+
+    # whether to access fields, the alias and aux objects through
+    # data descriptors instead of __getattribute__, see install_descriptors
+    _DESCRIPTORS_ = False
+
+    # RenderCache of the output of entity() and render_many across renders
+    _CACHE_ = None
+
+    # names of the related data the prefetch hook loads
+    # for each batch of entities, see prefetch
+    _PREFETCH_ = None
+
+    # dictionary of fields to the name of a method returning their version,
+    # so that Entity.diff reuses the previous value of a field whose
+    # version has not changed instead of resolving it again
+    _VERSIONS_ = None
+
+    # what the wrapped objects are: 'attributes' (or None) to proxy fields
+    # to their attributes, 'items' to proxy them to their items,
+    # for dicts and database rows such as sqlite3.Row
+    _SOURCE_ = None
+
+    def __init__(self, obj=None, **kwargs):
+        """
+        Binds the wrapped object and the aux objects
+
+        The class configuration has already been validated by EntityMeta
+        """
+        type(self).__plan.check_aux_objects(kwargs)
+
+        # store these away
+        self._o = obj
+        self.__aux = kwargs
+        self.__memo = None
+
+    def __render(self, timeout=None, only=None, exclude=None, output=DICT_OUTPUT, seed=None):
+        """
+        Builds the dictionary of the entity (or for other outputs, its row
+        or JSON) by rendering through the class plan (or its compiled render)
+
+        If any field returns SUPPRESS or throws SuppressField,
+        that field is not added to the dictionary
+
+        I/O-bound fields are run in the shared io_pool first,
+        waiting for them at most timeout seconds if given
+
+        With only or exclude, just the fields of that projection
+        are resolved, see EntityPlan.project
+
+        seed, if given, is a dictionary of field values to start
+        the memo of the render with, which are not resolved again
+        """
+        plan = type(self).__projected(only, exclude)
+        render = plan.renderer(type(self), output)
+
+        # inside another render, all of this already happened
+        if not (plan.prefetch or plan.io or seed) or object.__getattribute__(self, '_Entity__memo') is not None:
+            return render(self)
+
+        try:
+            if seed:
+                self.__memo = seed
+            if plan.prefetch:
+                plan.fill_prefetch(type(self), [self])
+            if plan.io:
+                plan.fill_io([self], timeout)
+            return render(self)
+        finally:
+            self.__memo = None
+
+    def __resolve_attr(self, attr):
+        """
+        Resolves an Attribute
+         - if it is a field, resolve it from the resolution table of the class plan
+           (which can call a method of the entity or proxy to the _o wrapped object),
+           memoized if this happens during a render
+
+         - if _ALIAS_ is set and the attribute is that alias, return the _o wrapped object
+         - if it is __dunder__, call object.__getattribute__
+         - if it is __Mangled_method, call object.__getattribute__
+         - if it a bootstrap attribute, return _FIELDS_ and _ALIAS_ from the
+           class plan and _o and _AUX_OBJECTS_ from the instance
+         - if the attribute is in _AUX_OBJECTS_, return it
+         - if the attribute is defined by Entity itself, call object.__getattribute__
+
+        Throws an AttributeError if ultimately unable to find it
+        Can also throw a SuppressField exception if we want to suppress that field
+        """
+        # fields first, they are by far the most common
+        # (the plan guarantees they collide with none of the below)
+        plan = type(self).__plan
+        entry = plan.lookup.get(attr)
+        if entry is not None:
+            kind, value = entry
+            memo = object.__getattribute__(self, '_Entity__memo')
+            if memo is None:
+                return resolve_unmemoized(self, attr, kind, value)
+            else:
+                return resolve_memoized(self, memo, attr, kind, value)
+
+        # then the alias, which field methods read all the time
+        if attr == plan.alias:
+            return object.__getattribute__(self, '_o')
+
+        # dunders and mangled get sent through
+        if DUNDER_MANGLE_RE.match(attr):
+            return object.__getattribute__(self, attr)
+
+        # bootstrap
+        if attr == '_ALIAS_':
+            return plan.alias
+        if attr == '_FIELDS_':
+            return plan.fields
+        if attr == '_o':
+            return object.__getattribute__(self, '_o')
+
+        _AUX_OBJECTS_ = object.__getattribute__(self, '_Entity__aux')
+        if attr == '_AUX_OBJECTS_':
+            return _AUX_OBJECTS_
+
+        if attr in _AUX_OBJECTS_:
+            return _AUX_OBJECTS_[attr]
+
+        # the methods and configuration of Entity itself
+        if attr in Entity.__dict__:
+            return object.__getattribute__(self, attr)
+
+        raise AttributeError('Entity %s has no field %s' % (
+            type(self).__name__,
+            attr,
+        ))
+
+    @classmethod
+    def __projected(klass, only, exclude):
+        """
+        Returns the plan of the class, projected if only or exclude is given
+        """
+        plan = klass.__plan
+        if only is not None or exclude is not None:
+            plan = plan.project(klass, only, exclude)
+        return plan
+
+    @classmethod
+    def __binder(klass, kwargs):
+        """
+        Checks the aux objects in kwargs once, and returns a function
+        binding an object and those aux objects into a new entity
+        """
+        klass.__plan.check_aux_objects(kwargs)
+
+        if klass.__init__ != Entity.__init__:
+            # an entity with its own __init__ has to go through it
+            def bind(obj):
+                return klass(obj, **kwargs)
+        else:
+            # the aux objects were checked above, so skip __init__
+            # and bind the entities directly
+            new = klass.__new__
+            def bind(obj):
+                entity = new(klass)
+                entity._o = obj
+                entity._Entity__aux = kwargs
+                entity._Entity__memo = None
+                return entity
+
+        return bind
+
+    @classmethod
+    def render_many(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Renders every object in objects, returning a list of dictionaries
+
+        Same as [klass(obj, **kwargs)() for obj in objects], but the
+        aux objects are checked only once for the whole batch
+        """
+        return list(klass.iter_render_many(objects, timeout, only, exclude, **kwargs))
+
+    @classmethod
+    def iter_render_many(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Generator version of render_many, yielding the dictionary
+        of each object as it is rendered
+
+        If the class has _PREFETCH_, batched or I/O-bound fields, the objects
+        are rendered in batches of _BATCH_SIZE_, prefetched together first.
+        The I/O-bound fields of a whole batch run in the shared io_pool
+        together, waiting for them at most timeout seconds per batch if given
+
+        With only or exclude, just the fields of that projection
+        are resolved, see EntityPlan.project
+        """
+        plan = klass.__projected(only, exclude)
+        return klass.__iter_rendered(plan, objects, timeout, only, exclude, kwargs, DICT_OUTPUT)
+
+    @classmethod
+    def iter_render_rows(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Like iter_render_many, but yields the row of each object
+        instead of its dictionary, see row
+        """
+        plan = klass.__projected(only, exclude)
+        return klass.__iter_rendered(plan, objects, timeout, only, exclude, kwargs, ROW_OUTPUT)
+
+    @classmethod
+    def iter_encode_many(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Like iter_render_many, but yields each object
+        encoded as JSON in UTF-8 bytes instead, see encode
+        """
+        plan = klass.__projected(only, exclude)
+        return klass.__iter_rendered(plan, objects, timeout, only, exclude, kwargs, JSON_OUTPUT)
+
+    @classmethod
+    def render_rows(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Renders every object in objects as a row, see row, and returns
+        the tuple of the fields (the header) and the list of rows
+        """
+        plan = klass.__projected(only, exclude)
+        rows = klass.__iter_rendered(plan, objects, timeout, only, exclude, kwargs, ROW_OUTPUT)
+        return plan.fields, list(rows)
+
+    @classmethod
+    def render_columns(klass, objects, timeout=None, only=None, exclude=None, **kwargs):
+        """
+        Renders every object in objects as a row, see row, and returns
+        the tuple of the fields and a list of one column per field,
+        the list of the values of that field for every object
+        """
+        plan = klass.__projected(only, exclude)
+        columns = [[] for field in plan.fields]
+        appends = [column.append for column in columns]
+
+        for row in klass.__iter_rendered(plan, objects, timeout, only, exclude, kwargs, ROW_OUTPUT):
+            for append, value in zip(appends, row):
+                append(value)
+
+        return plan.fields, columns
+
+    @classmethod
+    def __iter_rendered(klass, plan, objects, timeout, only, exclude, kwargs, output):
+        """
+        Yields the dictionary (or row, or JSON, see DICT_OUTPUT) of every object in objects,
+        rendered through plan, see iter_render_many
+        """
+        bind = klass.__binder(kwargs)
+
+        render = plan.renderer(klass, output)
+        cache = klass._CACHE_
+        projection = projection_key(only, exclude) + (output,)
+
+        if not plan.batched and not plan.io and not plan.prefetch:
+            if cache is not None:
+                render = cache.wrap(render, projection)
+            for obj in objects:
+                yield render(bind(obj))
+            return
+
+        for chunk in iter_chunks(objects, klass._BATCH_SIZE_):
+            entities = [bind(obj) for obj in chunk]
+
+            # look the chunk up in the cache first, so that only
+            # the misses are prefetched, batched and run I/O for
+            cached = None
+            misses = entities
+            if cache is not None:
+                cached = [cache.lookup(entity, projection) for entity in entities]
+                misses = [
+                    entity
+                    for entity, (key, result) in zip(entities, cached)
+                    if result is MISSING
+                ]
+
+            if misses:
+                if plan.prefetch:
+                    plan.fill_prefetch(klass, misses)
+                if plan.batched:
+                    plan.fill_batches(klass, misses)
+                if plan.io:
+                    plan.fill_io(misses, timeout)
+
+            if cached is None:
+                for entity in entities:
+                    yield render(entity)
+                continue
+
+            for entity, (key, result) in zip(entities, cached):
+                if result is MISSING:
+                    result = render(entity)
+                    cache.store(key, entity, projection, result)
+                yield result
+
+    @classmethod
+    def export(klass, objects, fp, format='ndjson', buffer_size=DEFAULT_BUFFER_SIZE,
+               progress=None, only=None, exclude=None, **kwargs):
+        """
+        Renders every object in objects and writes them to fp as NDJSON
+        (one JSON object per line) or CSV (with a header row of the fields),
+        in the order of _FIELDS_, and returns how many were written
+
+        Objects are read and rendered lazily like iter_render_many, and the
+        output is buffered up to about buffer_size characters between writes
+        (see dump), so memory stays flat however many objects there are.
+        progress, if given, is called with the number of objects
+        written so far after every write
+        """
+        plan = klass.__plan
+        if only is not None or exclude is not None:
+            plan = plan.project(klass, only, exclude)
+
+        try:
+            iterexport, output = EXPORT_FORMATS[format]
+        except KeyError:
+            raise ValueError("Unknown export format %r" % (format,))
+
+        written = [0]
+        def count(rows):
+            for row in rows:
+                written[0] += 1
+                yield row
+
+        on_write = None
+        if progress is not None:
+            on_write = lambda: progress(written[0])
+
+        rendered = klass.__iter_rendered(plan, objects, None, only, exclude, kwargs, output)
+        write_buffered(iterexport(plan.fields, count(rendered)), fp, buffer_size, on_write)
+        return written[0]
+
+    @classmethod
+    def iter_render_sharded(klass, objects, processes=None, chunk_size=None, aux_factory=None):
+        """
+        Renders every object in objects across a pool of processes,
+        yielding the list of dictionaries of each chunk of chunk_size
+        objects (_BATCH_SIZE_ by default), in order
+
+        klass is sent to the workers by reference, so it has to be importable,
+        and the objects have to be picklable. Aux objects usually are not,
+        so each worker builds its own by calling aux_factory once,
+        which returns the dictionary of aux objects.
+
+        At most two chunks per process are in flight at once,
+        so memory stays bounded whatever the length of objects
+        """
+        if processes is None:
+            processes = multiprocessing.cpu_count()
+        if chunk_size is None:
+            chunk_size = klass._BATCH_SIZE_
+
+        pool = multiprocessing.Pool(processes, init_shard_worker, (klass, aux_factory))
+        try:
+            pending = collections.deque()
+            for chunk in iter_chunks(objects, chunk_size):
+                pending.append(pool.apply_async(render_shard, (chunk,)))
+                if len(pending) >= 2 * processes:
+                    yield pending.popleft().get()
+
+            while pending:
+                yield pending.popleft().get()
+
+            pool.close()
+            pool.join()
+        finally:
+            pool.terminate()
+
+    def arender(self, concurrency=None):
+        """
+        Coroutine rendering the entity, for field methods that are
+        coroutine functions or otherwise return awaitables
+
+        The awaitables of the render run concurrently, at most concurrency
+        of them at a time if given. See pyentity_async (Python 3 only)
+        """
+        import pyentity_async
+        return pyentity_async.arender(self, concurrency)
+
+    @classmethod
+    def arender_many(klass, objects, concurrency=None, **kwargs):
+        """
+        Coroutine rendering every object in objects, like render_many
+
+        The awaitables of a whole batch of _BATCH_SIZE_ objects run concurrently,
+        at most concurrency of them at a time if given
+        """
+        import pyentity_async
+        return pyentity_async.arender_many(klass, klass.__binder(kwargs), objects, concurrency)
+
+    def invalidate(self, *fields):
+        """
+        Forgets the memoized values of fields (all of them if none are given)
+        in the current render, so they are resolved again when next read
+
+        Outside of a render nothing is memoized, so this does nothing
+        """
+        memo = self.__memo
+        if memo is None:
+            return
+
+        if not fields:
+            fields = type(self).__plan.fields
+
+        for field in fields:
+            memo.pop(field, None)
+
+    def rebind(self, obj):
+        """
+        Binds the entity to obj instead of its wrapped object, keeping
+        its aux objects (already checked), so that one entity can render
+        a whole stream of objects instead of one entity per object
+
+        Nothing carries over from the previous object: there is no memo
+        outside of a render, and whatever field methods stored on
+        the entity, in its __dict__ or in slots of its class, is dropped.
+        A class with its own __init__ goes through it again, with the
+        same aux objects, as in render_many
+
+        Throws a ValueError during a render of the entity
+        Returns the entity
+        """
+        klass = type(self)
+        if object.__getattribute__(self, '_Entity__memo') is not None:
+            raise ValueError("Cannot rebind %s during a render" % klass.__name__)
+
+        try:
+            object.__getattribute__(self, '__dict__').clear()
+        except AttributeError:
+            # slotted
+            pass
+
+        for name in klass.__plan.state_slots:
+            try:
+                object.__delattr__(self, name)
+            except AttributeError:
+                pass
+
+        if klass.__init__ != Entity.__init__:
+            self.__init__(obj, **object.__getattribute__(self, '_Entity__aux'))
+        else:
+            self._o = obj
+        return self
+
+    @classmethod
+    def prefetch(klass, entities, related):
+        """
+        Hook loading the related data named in _PREFETCH_ (passed as related)
+        for a whole batch of entities at once, before any field is resolved
+
+        Returns a dictionary of each name to a list of one value per entity,
+        which field methods read with self.prefetched(name), or None after
+        loading the data onto the wrapped objects (as ORMs do)
+
+        By default there is no related data to load, and returns None
+        """
+        return None
+
+    def prefetched(self, name):
+        """
+        Returns the related data name that the prefetch hook loaded
+        for this entity in the current render
+
+        Outside of a render, runs the prefetch hook for just this entity
+
+        Throws a KeyError if name is not in _PREFETCH_,
+        or if the prefetch hook did not return it
+        """
+        klass = type(self)
+        if not name in klass.__plan.prefetch:
+            raise KeyError("%s has no _PREFETCH_ entry %r" % (klass.__name__, name))
+
+        memo = self.__memo
+        if memo is not None and PREFETCHED in memo:
+            context = memo[PREFETCHED]
+        else:
+            context = klass.__plan.run_prefetch(klass, [self])[0]
+
+        try:
+            return context[name]
+        except KeyError:
+            raise KeyError("Prefetch of %s returned no _PREFETCH_ entry %r" % (klass.__name__, name))
+
     def __getitem__(self, attr):
         """
         If attr is in _FIELDS_, will pass it to getattr
@@ -270,9 +2198,99 @@ class Entity(object):
     def __dir__(self):
         return list(self._FIELDS_)
 
-    def __call__(self):
-        # iter calls __iter__
-        return dict(iter(self))
+    def __call__(self, timeout=None, only=None, exclude=None):
+        """
+        Renders the entity into a dictionary, see __render,
+        or returns it from the _CACHE_ of the class
+        """
+        # through the class, a mangled name is slow to look up on an entity
+        return Entity.__fetch(self, timeout, only, exclude, DICT_OUTPUT)
+
+    def row(self, timeout=None, only=None, exclude=None):
+        """
+        Renders the entity into a tuple of the values of its fields,
+        in the order of _FIELDS_, with SUPPRESS for suppressed fields,
+        which saves building a dictionary when the keys are not needed
+        """
+        return Entity.__fetch(self, timeout, only, exclude, ROW_OUTPUT)
+
+    def encode(self, timeout=None, only=None, exclude=None):
+        """
+        Renders the entity straight into a JSON object, in UTF-8 bytes,
+        through the encoder compiled for its class (see compile_render)
+        without building its dictionary, or returns it from the _CACHE_
+
+        The fields are written in the order of _FIELDS_, compactly
+        and without escaping non-ASCII characters (except on Python 2)
+        """
+        klass = type(self)
+        plan = klass.__plan
+        encoder = plan.encoder
+
+        # the whole entity, with nothing to run before the encoder
+        # and no cache, goes straight to the encoder
+        if (encoder is not None and only is None and exclude is None and instrumentation is None
+                and klass._CACHE_ is None and not plan.io and not plan.prefetch):
+            return encoder(self)
+
+        return Entity.__fetch(self, timeout, only, exclude, JSON_OUTPUT)
+
+    def diff(self, previous=None, timeout=None, only=None, exclude=None):
+        """
+        Renders the entity against previous, the Snapshot returned by
+        an earlier diff (or a dictionary returned by an earlier entity()),
+        and returns (snapshot, changed, removed): the Snapshot of this render,
+        the dictionary of the fields added or changed since previous,
+        and the list of the fields suppressed since, in the order of _FIELDS_
+
+        A field in _VERSIONS_ whose version is the same as in previous
+        is not resolved again, its previous value (or suppression) is reused.
+        Version methods are called with the entity, before the render
+
+        Always renders, bypassing the _CACHE_ of the class
+        """
+        if previous is None:
+            values, versions = {}, {}
+        elif isinstance(previous, Snapshot):
+            values, versions = previous
+        else:
+            values, versions = previous, {}
+
+        plan = type(self).__projected(only, exclude)
+
+        current = plan.get_versions(self)
+        seed = {}
+        for field, version in current.items():
+            if field in versions and versions[field] == version:
+                seed[field] = values.get(field, SUPPRESS)
+
+        rendered = self.__render(timeout, only, exclude, DICT_OUTPUT, seed)
+
+        changed = {}
+        removed = []
+        for field in plan.fields:
+            if field in rendered:
+                value = rendered[field]
+                if not field in values or values[field] != value:
+                    changed[field] = value
+            elif field in values:
+                removed.append(field)
+
+        return Snapshot(rendered, current), changed, removed
+
+    def __fetch(self, timeout, only, exclude, output):
+        """
+        Renders the entity, see __render, or returns it from the _CACHE_ of the class
+        """
+        cache = type(self)._CACHE_
+        if cache is None:
+            return Entity.__render(self, timeout, only, exclude, output)
+
+        return cache.fetch(
+            self,
+            projection_key(only, exclude) + (output,),
+            lambda: Entity.__render(self, timeout, only, exclude, output),
+        )
 
     def __rshift__(self, other):
         errstr = "Can only use >> entity shortcut with right hand side being empty dict"
@@ -289,10 +2307,297 @@ class Entity(object):
         Yields field, value pairs
         for non-supressed fields in order of _FIELDS_
         """
-        self.__reset_inner()
+        rendered = self.__render()
+        for field in type(self).__plan.fields:
+            if field in rendered:
+                yield (field, rendered[field])
+
+
+# the entity class and aux objects of a worker of iter_render_sharded
+shard_worker = None
+
+def init_shard_worker(klass, aux_factory):
+    """
+    Initializer of the worker processes of iter_render_sharded
+    """
+    global shard_worker
+
+    aux = {}
+    if aux_factory is not None:
+        aux = aux_factory()
+    shard_worker = (klass, aux)
+
+def render_shard(chunk):
+    """
+    Renders a chunk of objects in a worker of iter_render_sharded
+    """
+    klass, aux = shard_worker
+    return klass.render_many(chunk, **aux)
+
+
+def iterencode(entities, **kwargs):
+    """
+    Encodes an entity, or an iterable of entities, as JSON
+    yielding the output in chunks
+
+    An iterable is encoded as a JSON array, rendering each entity
+    only when it is reached, so the whole output is never held at once.
+    Fields are written in the order of _FIELDS_.
+    Rendered dictionaries are accepted in place of entities.
+
+    Keyword arguments are passed on to json.JSONEncoder,
+    except indent which is not supported
+    """
+    if kwargs.get('indent') is not None:
+        raise ValueError("iterencode does not support indent")
+
+    encoder = json.JSONEncoder(**kwargs)
+
+    if isinstance(entities, Entity):
+        return iterencode_entity(encoder, entities)
+    else:
+        return iterencode_array(encoder, entities)
+
+def iterencode_entity(encoder, entity):
+    """
+    Yields the JSON chunks of a single entity (or rendered dictionary)
+
+    Field values that are RawJSON are spliced in as they are
+    """
+    if isinstance(entity, Entity):
+        items = iter(entity)
+    elif isinstance(entity, dict):
+        items = entity.items()
+        if encoder.sort_keys:
+            items = sorted(items)
+    else:
+        for chunk in encoder.iterencode(entity):
+            yield chunk
+        return
+
+    encode = encoder.encode
+    key_separator = encoder.key_separator
+
+    separator = '{'
+    for field, value in items:
+        yield separator
+        yield encode(field)
+        yield key_separator
+        if isinstance(value, RawJSON):
+            yield value.text()
+        else:
+            for chunk in encoder.iterencode(value):
+                yield chunk
+        separator = encoder.item_separator
+
+    if separator == '{':
+        yield '{}'
+    else:
+        yield '}'
+
+def iterencode_array(encoder, entities):
+    """
+    Yields the JSON chunks of an array of entities
+    """
+    separator = '['
+    for entity in entities:
+        yield separator
+        for chunk in iterencode_entity(encoder, entity):
+            yield chunk
+        separator = encoder.item_separator
+
+    if separator == '[':
+        yield '[]'
+    else:
+        yield ']'
+
+def dump(entities, fp, buffer_size=DEFAULT_BUFFER_SIZE, **kwargs):
+    """
+    Writes an entity, or an iterable of entities, as JSON to fp
+
+    fp can be file-like (with write) or socket-like (with sendall).
+    Sockets and binary files get the output encoded as UTF-8.
+    The output of iterencode is buffered up to about buffer_size
+    characters between writes.
+
+    Keyword arguments are passed on to iterencode
+    """
+    write_buffered(iterencode(entities, **kwargs), fp, buffer_size)
+
+def write_buffered(chunks, fp, buffer_size, on_write=None):
+    """
+    Writes the chunks to fp (with write, or sendall for a socket),
+    joining them up to about buffer_size characters between writes,
+    and calls on_write, if given, after each write
+
+    Sockets and binary files are written the text encoded as UTF-8
+    """
+    write = getattr(fp, 'write', None)
+    if write is None:
+        write = fp.sendall
+        binary = True
+    else:
+        binary = isinstance(fp, (io.RawIOBase, io.BufferedIOBase))
+
+    if binary:
+        write_bytes = write
+        def write(data):
+            if isinstance(data, text_type):
+                data = data.encode('utf-8')
+            write_bytes(data)
+
+    buffered = []
+    size = 0
+    for chunk in chunks:
+        buffered.append(chunk)
+        size += len(chunk)
+        if size >= buffer_size:
+            write(''.join(buffered))
+            buffered = []
+            size = 0
+            if on_write is not None:
+                on_write()
+
+    if buffered:
+        write(''.join(buffered))
+        if on_write is not None:
+            on_write()
+
+# encodes text as a JSON string, in C where the json module has it:
+# without escaping non-ASCII characters, except on Python 2
+# where only escaping them is in C
+if getattr(json.encoder, 'c_encode_basestring', None) is not None:
+    encode_string = json.encoder.c_encode_basestring
+    ensure_ascii = False
+elif json.encoder.c_encode_basestring_ascii is not None:
+    encode_string = json.encoder.c_encode_basestring_ascii
+    ensure_ascii = True
+else:
+    encode_string = json.encoder.encode_basestring
+    ensure_ascii = False
+
+# encodes any other value as JSON, compactly and without checking for
+# circular references (like json.dumps with check_circular=False),
+# through the C encoder of the json module where there is one
+value_encoder = json.JSONEncoder(separators=(',', ':'), ensure_ascii=ensure_ascii, check_circular=False)
+if json.encoder.c_make_encoder is None:
+    def encode_json(value):
+        return ''.join(value_encoder.iterencode(value))
+else:
+    c_iterencode = json.encoder.c_make_encoder(
+        None,
+        value_encoder.default,
+        encode_string,
+        None,
+        ':',
+        ',',
+        False,
+        False,
+        True,
+    )
+    def encode_json(value):
+        return ''.join(c_iterencode(value, 0))
+
+def encode_row(fields, row):
+    """
+    Encodes a row (see Entity.row) as the JSON object of its fields,
+    in UTF-8 bytes, like the JSON encoders of compile_render
+    """
+    parts = []
+    for field, value in zip(fields, row):
+        if value is SUPPRESS:
+            continue
+        if isinstance(value, RawJSON):
+            value = value.text()
+        elif isinstance(value, string_types):
+            value = encode_string(value)
+        else:
+            value = encode_json(value)
+        parts.append(encode_string(field) + ':' + value)
+
+    return ('{' + ','.join(parts) + '}').encode('utf-8')
+
+def iterexport_ndjson(fields, rows):
+    """
+    Yields one line of JSON for each rendered dictionary in rows,
+    with its fields in the order of fields
+    """
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+
+    for rendered in rows:
+        yield '{%s}\n' % ','.join([
+            '%s:%s' % (encode(field), encode_value(encode, rendered[field]))
+            for field in fields
+            if field in rendered
+        ])
+
+def encode_value(encode, value):
+    """
+    Encodes value with encode, unless it is already RawJSON
+    """
+    if isinstance(value, RawJSON):
+        return value.text()
+    return encode(value)
+
+
+class LineBuffer(list):
+    """
+    List that csv.writer can write to
+    """
+
+    def write(self, line):
+        self.append(line)
+
+
+def csv_value(encode, value):
+    """
+    Value of a CSV cell: None and suppressed fields are empty, lists and
+    dictionaries are written as JSON (as is RawJSON), text as UTF-8 on Python 2
+    """
+    if value is None or value is SUPPRESS:
+        return ''
+    if isinstance(value, RawJSON):
+        value = value.text()
+    elif isinstance(value, (list, tuple, dict)):
+        return encode(value)
+    if isinstance(value, text_type) and not text_type is str:
+        return value.encode('utf-8')
+    return value
+
+def iterexport_csv(fields, rows):
+    """
+    Yields a CSV header row of fields, then one CSV row
+    for each row in rows (see Entity.row)
+    """
+    encode = json.JSONEncoder(separators=(',', ':')).encode
+    lines = LineBuffer()
+    writer = csv.writer(lines)
+
+    writer.writerow(fields)
+    for row in rows:
+        writer.writerow([csv_value(encode, value) for value in row])
+        for line in lines:
+            yield line
+        del lines[:]
+
+    for line in lines:
+        yield line
+
+# the formats of Entity.export, and whether they take rows or dictionaries
+EXPORT_FORMATS = {
+    'ndjson' : (iterexport_ndjson, DICT_OUTPUT),
+    'csv' : (iterexport_csv, ROW_OUTPUT),
+}
+
+
+class SlottedEntity(Entity):
+    """
+    Base for entities whose instances have no __dict__ at all,
+    only the slots of Entity
+
+    Its subclasses get empty __slots__ automatically (see EntityMeta),
+    so field methods cannot store attributes on the entity
+    unless a subclass declares slots for them
+    """
 
-        # Cache this locally
-        __inner = self.__inner
-        for field in self._FIELDS_:
-            if field in __inner:
-                yield (field, __inner[field])
+    __slots__ = ()
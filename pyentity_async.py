@@ -0,0 +1,226 @@
+"""
+Async rendering of entities, on Python 3
+
+Field methods can be coroutine functions, or return any other awaitable.
+Entity.arender and Entity.arender_many resolve every field first, which
+starts the awaitables, then await them all concurrently.
+"""
+import asyncio
+import inspect
+
+from pyentity import SUPPRESS, SuppressField, resolve_memoized, iter_chunks
+
+
+# asyncio.current_task is only there from Python 3.7
+current_task = getattr(asyncio, 'current_task', None) or asyncio.Task.current_task
+
+
+class AsyncMemo(dict):
+    """
+    Memo of the field values of an async render
+
+    Awaitable values are wrapped into tasks as they are memoized,
+    limited by semaphore if there is one, so that a field method can
+    await another field (`await self.other`) and the render can
+    await it too, without anything being awaited twice.
+
+    A field holding a slot of the semaphore that reads another field
+    gets a SlotReleasingWait for its task instead, so that it does not
+    keep the slot (which the other field may need) while waiting for it
+    """
+
+    def __init__(self, semaphore):
+        dict.__init__(self)
+        self.semaphore = semaphore
+        # the tasks holding a slot of the semaphore
+        self.holding = set()
+        # the awaitables wrapped into tasks, see cancel
+        self.awaitables = []
+
+    def __setitem__(self, field, value):
+        if inspect.isawaitable(value) and not isinstance(value, asyncio.Future):
+            self.awaitables.append(value)
+            value = asyncio.ensure_future(self.limit(value))
+        dict.__setitem__(self, field, value)
+
+    def __getitem__(self, field):
+        value = dict.__getitem__(self, field)
+        if self.holding and isinstance(value, asyncio.Future) and not value.done():
+            task = current_task()
+            if task in self.holding:
+                return SlotReleasingWait(self, task, value)
+        return value
+
+    async def limit(self, awaitable):
+        if self.semaphore is None:
+            return await awaitable
+
+        await self.semaphore.acquire()
+        task = current_task()
+        self.holding.add(task)
+        try:
+            return await awaitable
+        finally:
+            # not holding a slot if cancelled waiting for one again
+            if task in self.holding:
+                self.holding.discard(task)
+                self.semaphore.release()
+
+    def tasks(self):
+        return [value for value in self.values() if isinstance(value, asyncio.Future)]
+
+
+class SlotReleasingWait(object):
+    """
+    Awaitable of the task of a field, for the task of another field that
+    holds a slot of the semaphore of memo: gives the slot up while
+    waiting, and takes one again before going on
+    """
+
+    __slots__ = ('memo', 'task', 'future')
+
+    def __init__(self, memo, task, future):
+        self.memo = memo
+        self.task = task
+        self.future = future
+
+    def __await__(self):
+        return self.wait().__await__()
+
+    async def wait(self):
+        memo = self.memo
+        memo.holding.discard(self.task)
+        memo.semaphore.release()
+        try:
+            return await self.future
+        finally:
+            await memo.semaphore.acquire()
+            memo.holding.add(self.task)
+
+
+def make_semaphore(concurrency):
+    if concurrency is None:
+        return None
+    return asyncio.Semaphore(concurrency)
+
+def start(entity, memo):
+    """
+    Resolves every field of entity into memo, which starts their awaitables
+
+    Values already in the memo of the entity (as seeded by
+    EntityPlan.fill_prefetch and fill_batches) are carried over
+    """
+    seeded = object.__getattribute__(entity, '_Entity__memo')
+    if seeded:
+        dict.update(memo, seeded)
+    entity._Entity__memo = memo
+
+    for field, kind, value in type(entity)._Entity__plan.resolution:
+        try:
+            resolve_memoized(entity, memo, field, kind, value)
+        except SuppressField:
+            pass
+
+async def cancel(memos):
+    """
+    Cancels the tasks of fields already started in memos when resolving
+    another one fails, and waits for them to be done
+
+    The coroutines of tasks cancelled before they ran are closed,
+    as nothing will await them
+    """
+    tasks = [task for memo in memos for task in memo.tasks()]
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+    for memo in memos:
+        for awaitable in memo.awaitables:
+            if inspect.iscoroutine(awaitable):
+                awaitable.close()
+
+def collect(entity, memo):
+    """
+    Builds the dictionary of entity, in the order of _FIELDS_,
+    once all the tasks in memo are done
+
+    A task that returned SUPPRESS or raised SuppressField
+    suppresses its field, any other exception
+    is raised again (that of the first such field in _FIELDS_)
+    """
+    result = {}
+    for field in type(entity)._Entity__plan.fields:
+        value = memo[field]
+
+        if isinstance(value, asyncio.Future):
+            if isinstance(value.exception(), SuppressField):
+                continue
+            value = value.result()
+
+        if not value is SUPPRESS:
+            result[field] = value
+
+    return result
+
+async def arender(entity, concurrency=None):
+    """
+    Renders entity, awaiting its awaitable fields concurrently,
+    at most concurrency of them at a time if given
+    """
+    klass = type(entity)
+    memo = AsyncMemo(make_semaphore(concurrency))
+    previous = object.__getattribute__(entity, '_Entity__memo')
+
+    try:
+        if klass._Entity__plan.prefetch and previous is None:
+            klass._Entity__plan.fill_prefetch(klass, [entity])
+        try:
+            start(entity, memo)
+        except Exception:
+            await cancel([memo])
+            raise
+        await asyncio.gather(*memo.tasks(), return_exceptions=True)
+        return collect(entity, memo)
+    finally:
+        entity._Entity__memo = previous
+
+async def arender_many(klass, bind, objects, concurrency=None):
+    """
+    Renders every object in objects as a klass entity, bound with bind
+
+    The objects are taken in batches of _BATCH_SIZE_, and the awaitable
+    fields of a whole batch are awaited concurrently, at most
+    concurrency of them at a time if given
+    """
+    plan = klass._Entity__plan
+    semaphore = make_semaphore(concurrency)
+
+    rendered = []
+    for chunk in iter_chunks(objects, klass._BATCH_SIZE_):
+        entities = [bind(obj) for obj in chunk]
+        if plan.prefetch:
+            plan.fill_prefetch(klass, entities)
+        if plan.batched:
+            plan.fill_batches(klass, entities)
+
+        memos = []
+        try:
+            for entity in entities:
+                memo = AsyncMemo(semaphore)
+                memos.append(memo)
+                start(entity, memo)
+        except Exception:
+            await cancel(memos)
+            for entity in entities:
+                entity._Entity__memo = None
+            raise
+
+        tasks = [task for memo in memos for task in memo.tasks()]
+
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+        for entity, memo in zip(entities, memos):
+            entity._Entity__memo = None
+            rendered.append(collect(entity, memo))
+
+    return rendered
@@ -6,5 +6,5 @@ setup(
     author='Louis Sobel',
     author_email='louis.a.sobel@gmail.com',
     url='http://github.com/louissobel/py-entity',
-    py_modules=['pyentity'],
+    py_modules=['pyentity', 'pyentity_async'],
 )
@@ -1,6 +1,21 @@
+import io
+import json
+import collections
+import time
+import pickle
+import socket
+import sqlite3
 import unittest
+import threading
 
-from pyentity import Entity, SuppressField
+import pyentity
+from pyentity import Entity, SuppressField, batched, io_bound
+
+try:
+    import concurrent.futures
+except ImportError:
+    # Python 2 without the futures backport
+    concurrent = None
 
 ########################################
 # Test Fixtures
@@ -56,6 +71,9 @@ class MainEntity(Entity):
     def aux_object_method(self):
         return self.aux_object.foobar
 
+    def helper(self):
+        return 'helped'
+
 MAIN_EXPECTED_HASH = {
     'snow' : 'COLD',
     'haha' : 'hehe',
@@ -155,64 +173,10 @@ class ChildBreaksEntity(MainEntity):
     _AUX_OBJECTS_ = []
 
 # some corner case entities
-class NonStringAliasEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _ALIAS_ = {}
-
-
-class BadIdentifierAliasEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _ALIAS_ = '$$$ dfkj dfjds'
-
-
 class EmptyFieldsEntity(Entity):
     pass
 
 
-class ReservedWordFieldEntity(Entity):
-    _FIELDS_ = ['_FIELDS_']
-
-
-class AliasAsAFieldEntity(Entity):
-    _FIELDS_ = ['hello', 'wrapped', 'foo', 'bar']
-    _ALIAS_ = 'wrapped'
-
-
-class DunderInFieldEntity(Entity):
-    _FIELDS_ = ['hello', '__dunder__']
-
-
-class BadAuxTypeEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _AUX_OBJECTS_ = 'string'
-
-
-class ReservedWordAuxEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _AUX_OBJECTS_ = ['_AUX_OBJECTS_']
-
-
-class AuxFieldCollisionEntity(Entity):
-    _FIELDS_ = ['foobar', 'foo']
-    _AUX_OBJECTS_ = ['foo']
-
-
-class DunderInAuxObjectsEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _AUX_OBJECTS_ = ['__dunder__']
-
-
-class InvalidIdentifierAuxObjectsEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _AUX_OBJECTS_ = ['BAD IDENTIFIER BAD IDENTIFER $#@)(  3290908 )']
-
-
-class AliasAuxObjectsCollisionEntity(Entity):
-    _FIELDS_ = ['foobar']
-    _ALIAS_ = 'lolol'
-    _AUX_OBJECTS_ = ['lolol']
-
-
 ########################################
 # Test Cases
 
@@ -247,6 +211,35 @@ class ChildTestCase(unittest.TestCase):
         self.assertEqual(cent(), CHILD_EXPECTED_HASH)
 
 
+class GrandChildTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class GrandChildEntity(ChildEntity):
+            _FIELDS_ = ['ent_alias_method', 'subent_method', 'fire', 'haha']
+
+        obj = RepresentMe()
+        ent = GrandChildEntity(obj)
+
+        self.assertEqual(ent(), {
+            'ent_alias_method' : 'echoWRAP',
+            'subent_method' : 'SUB',
+            'fire' : 'VERY HOT',
+            'haha' : 'hehe',
+        })
+        self.assertEqual(ent.subent_method, 'SUB')
+
+
+class ResolutionTableTestCase(unittest.TestCase):
+
+    def runTest(self):
+        lookup = ChildEntity._Entity__plan.lookup
+
+        self.assertEqual(lookup['snow'], ('constant', 'COLD'))
+        self.assertEqual(lookup['fire'], ('constant', 'VERY HOT'))
+        self.assertEqual(lookup['ent_method'], ('method', MainEntity.__dict__['ent_method']))
+        self.assertEqual(lookup['foobar'], ('proxy', None))
+
+
 class DirTest(unittest.TestCase):
 
     def runTest(self):
@@ -295,6 +288,77 @@ class SuppressingIterationTestCase(unittest.TestCase):
         ])
 
 
+class SuppressReturningEntity(Entity):
+    _FIELDS_ = ['hello', 'foobar', 'a_value', 'label', 'batch']
+
+    hello = 7
+
+    def foobar(self):
+        if self._o.foobar < 1:
+            return pyentity.SUPPRESS
+        return self._o.foobar
+
+    def label(self):
+        try:
+            return 'foobar %s' % self.foobar
+        except AttributeError:
+            return 'no foobar'
+
+    @batched
+    def batch(cls, entities):
+        return [pyentity.SUPPRESS if entity._o.foobar < 1 else 'batch' for entity in entities]
+
+
+class SuppressReturningTestCase(unittest.TestCase):
+
+    def runTest(self):
+        obj = RepresentMe()
+        obj.foobar = 0
+        expected = {
+            'hello' : 7,
+            'a_value' : 100,
+            'label' : 'no foobar',
+        }
+
+        class CompiledSuppressReturningEntity(SuppressReturningEntity):
+            _COMPILED_ = True
+
+        for klass in (SuppressReturningEntity, CompiledSuppressReturningEntity):
+            ent = klass(obj)
+            self.assertEqual(ent(), expected)
+            self.assertEqual(ent.row(), (7, pyentity.SUPPRESS, 100, 'no foobar', pyentity.SUPPRESS))
+            self.assertEqual(klass.render_many([obj, RepresentMe()]), [expected, {
+                'hello' : 7,
+                'foobar' : 5,
+                'a_value' : 100,
+                'label' : 'foobar 5',
+                'batch' : 'batch',
+            }])
+
+        # reading a suppressed field outside a render is as if it raised
+        with self.assertRaisesRegexp(AttributeError, 'suppressed'):
+            SuppressReturningEntity(obj).foobar
+
+        # a constant SUPPRESS leaves out a field of the base class
+        class NoHelloEntity(SuppressReturningEntity):
+            hello = pyentity.SUPPRESS
+
+        class CompiledNoHelloEntity(NoHelloEntity):
+            _COMPILED_ = True
+
+        for klass in (NoHelloEntity, CompiledNoHelloEntity):
+            self.assertNotIn('hello', klass(obj)())
+            self.assertIs(klass(obj).row()[0], pyentity.SUPPRESS)
+
+        pyentity.enable_instrumentation()
+        try:
+            SuppressReturningEntity(obj)()
+            stats = pyentity.instrumentation_snapshot()
+        finally:
+            pyentity.disable_instrumentation()
+        self.assertEqual(stats[SuppressReturningEntity, 'foobar']['suppressed'], 1)
+
+
 class MultipleAuxTestCase(unittest.TestCase):
 
     def runTest(self):
@@ -446,14 +510,18 @@ class NonStringAliasTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'basestring'):
-            NonStringAliasEntity()
+            class NonStringAliasEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _ALIAS_ = {}
 
 
 class BadIdentifierAliasTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'legal identifier'):
-            BadIdentifierAliasEntity()
+            class BadIdentifierAliasEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _ALIAS_ = '$$$ dfkj dfjds'
 
 
 class EmptyFieldsTestCase(unittest.TestCase):
@@ -467,63 +535,1675 @@ class ReservedWordFieldTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'reserved attribute'):
-            ReservedWordFieldEntity()
+            class ReservedWordFieldEntity(Entity):
+                _FIELDS_ = ['_FIELDS_']
 
 
 class AliasAsAFieldTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'between'):
-            AliasAsAFieldEntity()
+            class AliasAsAFieldEntity(Entity):
+                _FIELDS_ = ['hello', 'wrapped', 'foo', 'bar']
+                _ALIAS_ = 'wrapped'
 
 
 class DunderInFieldTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'double underscore'):
-            DunderInFieldEntity()
+            class DunderInFieldEntity(Entity):
+                _FIELDS_ = ['hello', '__dunder__']
 
 
 class BadAuxTypeTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'list'):
-            BadAuxTypeEntity()
+            class BadAuxTypeEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _AUX_OBJECTS_ = 'string'
 
 
 class ReservedWordAuxTextCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'reserved attribute'):
-            ReservedWordAuxEntity()
+            class ReservedWordAuxEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _AUX_OBJECTS_ = ['_AUX_OBJECTS_']
 
 
 class AuxFieldCollisionTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'Collision'):
-            AuxFieldCollisionEntity()
+            class AuxFieldCollisionEntity(Entity):
+                _FIELDS_ = ['foobar', 'foo']
+                _AUX_OBJECTS_ = ['foo']
 
 
 class DunderInAuxObjectsTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'double underscore'):
-            DunderInAuxObjectsEntity()
+            class DunderInAuxObjectsEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _AUX_OBJECTS_ = ['__dunder__']
 
 
 class InvalidIdentifierAuxObjectsTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'legal identifier'):
-            InvalidIdentifierAuxObjectsEntity()
+            class InvalidIdentifierAuxObjectsEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _AUX_OBJECTS_ = ['BAD IDENTIFIER BAD IDENTIFER $#@)(  3290908 )']
 
 
 class AliasAuxObjectsCollisionTestCase(unittest.TestCase):
 
     def runTest(self):
         with self.assertRaisesRegexp(ValueError, 'Collision'):
-            AliasAuxObjectsCollisionEntity()
+            class AliasAuxObjectsCollisionEntity(Entity):
+                _FIELDS_ = ['foobar']
+                _ALIAS_ = 'lolol'
+                _AUX_OBJECTS_ = ['lolol']
+
+
+class ChildInvalidConfigTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # the child's combination of inherited and own config is checked too
+        with self.assertRaisesRegexp(ValueError, 'Collision'):
+            class ChildInvalidConfigEntity(MainEntity):
+                _FIELDS_ = ['snow', 'aux_object']
+
+
+class InitOnlyBindsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        obj = RepresentMe()
+        aux = AuxObject()
+        ent = MainEntity(obj, aux_object=aux)
+
+        self.assertEqual(ent._o, obj)
+        self.assertEqual(ent._AUX_OBJECTS_, {'aux_object' : aux})
+        self.assertEqual(ent._FIELDS_, tuple(MainEntity._FIELDS_))
+
+        # all of it is in the slots of Entity, nothing in __dict__
+        self.assertEqual(ent.__dict__, {})
+
+class CompiledEquivalenceTestCase(unittest.TestCase):
+
+    def assertSameRender(self, klass, obj, **aux):
+        class CompiledEntity(klass):
+            _COMPILED_ = True
+
+        self.assertIsNotNone(CompiledEntity._Entity__plan.compiled)
+        self.assertEqual(CompiledEntity(obj, **aux)(), klass(obj, **aux)())
+
+    def runTest(self):
+        obj = RepresentMe()
+        aux = AuxObject()
+
+        self.assertSameRender(MainEntity, obj, aux_object=aux)
+        self.assertSameRender(ChildEntity, obj)
+        self.assertSameRender(SuppressingEntity, obj)
+        self.assertSameRender(MultipleAuxObjectEntity, obj, aux1=aux, aux2=aux)
+        self.assertSameRender(EmptyFieldsEntity, obj)
+
+        obj.foobar = 0
+        self.assertSameRender(SuppressingEntity, obj)
+
+
+class CompiledBrokenTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CompiledBrokenEntity(BrokenEntity):
+            _COMPILED_ = True
+
+        with self.assertRaisesRegexp(AttributeError, 'Cannot find'):
+            CompiledBrokenEntity(RepresentMe())()
+
+
+class CompiledConstantsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CompiledConstantsEntity(Entity):
+            _FIELDS_ = ['inlined', 'bound', 'nan']
+            _COMPILED_ = True
+
+            inlined = 'literal'
+            bound = ['not', 'a', 'literal']
+            nan = float('nan')
+
+        result = CompiledConstantsEntity()()
+        self.assertEqual(result['inlined'], 'literal')
+        self.assertIs(result['bound'], CompiledConstantsEntity.bound)
+        self.assertNotEqual(result['nan'], result['nan'])
+
+        with self.assertRaisesRegexp(ValueError, 'reserved attribute'):
+            class CompiledFieldEntity(Entity):
+                _FIELDS_ = ['_COMPILED_']
+
+class RenderManyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        objs = [RepresentMe(), RepresentMe()]
+        objs[1].foobar = 0
+        aux = AuxObject()
+
+        self.assertEqual(
+            MainEntity.render_many(objs, aux_object=aux),
+            [MainEntity(obj, aux_object=aux)() for obj in objs],
+        )
+        self.assertEqual(
+            SuppressingEntity.render_many(objs),
+            [SuppressingEntity(obj)() for obj in objs],
+        )
+
+
+class IterRenderManyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        objs = iter([RepresentMe(), RepresentMe()])
+        rendered = ChildEntity.iter_render_many(objs)
+
+        self.assertEqual(next(rendered), CHILD_EXPECTED_HASH)
+        self.assertEqual(list(rendered), [CHILD_EXPECTED_HASH])
+
+
+class RenderManyAuxObjectsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        with self.assertRaisesRegexp(TypeError, 'aux2'):
+            MultipleAuxObjectEntity.render_many([], aux1=AuxObject())
+
+        with self.assertRaisesRegexp(TypeError, 'aux3'):
+            MultipleAuxObjectEntity.render_many([], aux1=1, aux2=2, aux3=3)
+
+
+class RenderManyCustomInitTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CustomInitEntity(SuppressingEntity):
+            def __init__(self, obj):
+                obj.foobar = 0
+                super(CustomInitEntity, self).__init__(obj)
+
+        self.assertEqual(CustomInitEntity.render_many([RepresentMe()]), [{
+            'hello' : 7,
+            'a_value' : 100,
+        }])
+
+
+class ItemSourceEntity(Entity):
+    _FIELDS_ = ['id', 'name', 'label', 'email']
+    _ALIAS_ = 'row'
+    _SOURCE_ = 'items'
+
+    def label(self):
+        return '%s <%s>' % (self.name, self.email)
+
+ITEM_SOURCE_EXPECTED_HASH = {
+    'id' : 1,
+    'name' : 'George',
+    'label' : 'George <prez1@whouse.gov>',
+    'email' : 'prez1@whouse.gov',
+}
+
+class ItemSourceTestCase(unittest.TestCase):
+
+    def runTest(self):
+        values = (1, 'George', 'prez1@whouse.gov')
+
+        connection = sqlite3.connect(':memory:')
+        connection.row_factory = sqlite3.Row
+        row = connection.execute('select ? as id, ? as name, ? as email', values).fetchone()
+        mapping = {'id' : 1, 'name' : 'George', 'email' : 'prez1@whouse.gov'}
+
+        for obj in (row, mapping):
+            self.assertEqual(ItemSourceEntity(obj)(), ITEM_SOURCE_EXPECTED_HASH)
+            self.assertEqual(ItemSourceEntity(obj).name, 'George')
+
+        self.assertEqual(ItemSourceEntity.render_many([row, mapping]), [ITEM_SOURCE_EXPECTED_HASH] * 2)
+        self.assertEqual(ItemSourceEntity.render_rows([row], only=['name', 'email']), (
+            ('name', 'email'),
+            [('George', 'prez1@whouse.gov')],
+        ))
+
+        class CompiledItemSourceEntity(ItemSourceEntity):
+            _COMPILED_ = True
+
+        self.assertEqual(CompiledItemSourceEntity(row)(), ITEM_SOURCE_EXPECTED_HASH)
+
+        # items are not called, the whole lookup is not retried
+        # and a missing one is named
+        mapping = {'id' : len, 'name' : 'George'}
+        with self.assertRaisesRegexp(AttributeError, "'email'"):
+            ItemSourceEntity(mapping)()
+        with self.assertRaisesRegexp(AttributeError, "'email'"):
+            CompiledItemSourceEntity(mapping)()
+
+        mapping['email'] = 'prez1@whouse.gov'
+        self.assertIs(ItemSourceEntity(mapping)()['id'], len)
+
+        with self.assertRaisesRegexp(ValueError, '_SOURCE_'):
+            class BadSourceEntity(Entity):
+                _SOURCE_ = 'rows'
+
+
+class AttributeSourceTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class Person(collections.namedtuple('Person', ['id', 'name', 'email'])):
+            __slots__ = ()
+
+            def initial(self):
+                return self.name[0]
+
+        class PersonEntity(Entity):
+            _FIELDS_ = ['id', 'name', 'email', 'initial']
+
+        obj = Person(1, 'George', 'prez1@whouse.gov')
+        self.assertEqual(PersonEntity(obj)(), {
+            'id' : 1,
+            'name' : 'George',
+            'email' : 'prez1@whouse.gov',
+            # a callable attribute is still called
+            'initial' : 'G',
+        })
+        # attributes are not read all at once
+        self.assertIs(PersonEntity._Entity__plan.proxies, None)
+
+        # a missing attribute is still named
+        class WiderEntity(PersonEntity):
+            _FIELDS_ = ['id', 'phone', 'name']
+
+        with self.assertRaisesRegexp(AttributeError, "'phone'"):
+            WiderEntity(obj)()
+
+        # each property is read once, in the order of the fields,
+        # even when one suppresses itself
+        calls = []
+
+        class Row(object):
+            @property
+            def a(self):
+                calls.append('a')
+                return 1
+
+            @property
+            def b(self):
+                calls.append('b')
+                raise SuppressField
+
+            @property
+            def c(self):
+                calls.append('c')
+                return 3
+
+        class RowEntity(Entity):
+            _FIELDS_ = ['a', 'double', 'b', 'c']
+
+            def double(self):
+                calls.append('double')
+                return self.a * 2
+
+        class CompiledRowEntity(RowEntity):
+            _COMPILED_ = True
+
+        for klass in (RowEntity, CompiledRowEntity):
+            del calls[:]
+            self.assertEqual(klass(Row())(), {'a' : 1, 'double' : 2, 'c' : 3})
+            self.assertEqual(calls, ['a', 'double', 'b', 'c'])
+
+
+class BatchedFieldTestCase(unittest.TestCase):
+
+    def runTest(self):
+        calls = []
+
+        class BatchedEntity(Entity):
+            _FIELDS_ = ['foobar', 'doubled']
+            _ALIAS_ = 'obj'
+
+            @batched
+            def doubled(cls, entities):
+                calls.append(len(entities))
+                return [
+                    SuppressField if entity.obj.foobar < 1 else entity.obj.foobar * 2
+                    for entity in entities
+                ]
+
+        objs = [RepresentMe() for i in range(3)]
+        objs[1].foobar = 0
+
+        self.assertEqual(BatchedEntity.render_many(objs), [
+            {'foobar' : 5, 'doubled' : 10},
+            {'foobar' : 0},
+            {'foobar' : 5, 'doubled' : 10},
+        ])
+        self.assertEqual(calls, [3])
+
+        # alone, an entity is a batch of one
+        self.assertEqual(BatchedEntity(objs[0])(), {'foobar' : 5, 'doubled' : 10})
+        self.assertEqual(BatchedEntity(objs[0]).doubled, 10)
+        with self.assertRaisesRegexp(AttributeError, 'suppressed'):
+            BatchedEntity(objs[1]).doubled
+        self.assertEqual(calls, [3, 1, 1, 1])
+
+        # the compiled render agrees
+        class CompiledBatchedEntity(BatchedEntity):
+            _COMPILED_ = True
+            _BATCH_SIZE_ = 2
+
+        del calls[:]
+        self.assertEqual(CompiledBatchedEntity.render_many(objs), BatchedEntity.render_many(objs))
+        self.assertEqual(calls, [2, 1, 3])
+
+
+class BatchedFieldErrorsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class SuppressedBatchEntity(Entity):
+            _FIELDS_ = ['haha', 'nothing']
+
+            @batched
+            def nothing(cls, entities):
+                raise SuppressField
+
+        self.assertEqual(
+            SuppressedBatchEntity.render_many([RepresentMe(), RepresentMe()]),
+            [{'haha' : 'hehe'}, {'haha' : 'hehe'}],
+        )
+
+        class WrongLengthEntity(Entity):
+            _FIELDS_ = ['short']
+
+            @batched
+            def short(cls, entities):
+                return []
+
+        with self.assertRaisesRegexp(ValueError, 'returned 0 values for 2 entities'):
+            WrongLengthEntity.render_many([RepresentMe(), RepresentMe()])
+
+
+class PrefetchTestCase(unittest.TestCase):
+
+    def runTest(self):
+        calls = []
+
+        class PrefetchingEntity(Entity):
+            _FIELDS_ = ['foobar', 'group', 'doubled_group']
+            _ALIAS_ = 'obj'
+            _PREFETCH_ = ['groups']
+
+            @classmethod
+            def prefetch(cls, entities, related):
+                calls.append((len(entities), related))
+                return {'groups' : ['group%d' % entity.obj.foobar for entity in entities]}
+
+            def group(self):
+                self.invalidate()
+                return self.prefetched('groups')
+
+            @batched
+            def doubled_group(cls, entities):
+                return [entity.prefetched('groups') * 2 for entity in entities]
+
+        objs = [RepresentMe() for i in range(3)]
+        objs[1].foobar = 1
+
+        self.assertEqual(PrefetchingEntity.render_many(objs)[:2], [
+            {'foobar' : 5, 'group' : 'group5', 'doubled_group' : 'group5group5'},
+            {'foobar' : 1, 'group' : 'group1', 'doubled_group' : 'group1group1'},
+        ])
+        self.assertEqual(calls, [(3, ('groups',))])
+
+        class SmallBatchEntity(PrefetchingEntity):
+            _BATCH_SIZE_ = 2
+
+        del calls[:]
+        SmallBatchEntity.render_many(objs)
+        self.assertEqual(calls, [(2, ('groups',)), (1, ('groups',))])
+
+        # alone, an entity is a batch of one, and so is reading it outside of a render
+        del calls[:]
+        ent = PrefetchingEntity(objs[1])
+        self.assertEqual(ent()['group'], 'group1')
+        self.assertEqual(ent.group, 'group1')
+        self.assertEqual(calls, [(1, ('groups',)), (1, ('groups',))])
+        self.assertIsNone(ent._Entity__memo)
+
+        class LoadingEntity(Entity):
+            _FIELDS_ = ['group']
+            _PREFETCH_ = ['group']
+
+            @classmethod
+            def prefetch(cls, entities, related):
+                # loads it on the objects, like an ORM
+                for entity in entities:
+                    entity._o.group = 'loaded'
+
+        self.assertEqual(LoadingEntity.render_many(objs[:1]), [{'group' : 'loaded'}])
+
+
+class PrefetchErrorsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        with self.assertRaisesRegexp(ValueError, 'no prefetch hook'):
+            class NoHookEntity(Entity):
+                _PREFETCH_ = ['groups']
+
+        with self.assertRaisesRegexp(ValueError, 'must be a list'):
+            class BadPrefetchEntity(Entity):
+                _PREFETCH_ = 'groups'
+
+        class WrongLengthEntity(Entity):
+            _FIELDS_ = ['haha']
+            _PREFETCH_ = ['groups']
+
+            @classmethod
+            def prefetch(cls, entities, related):
+                return {'groups' : []}
+
+        with self.assertRaisesRegexp(ValueError, 'returned 0 values for 2 entities'):
+            WrongLengthEntity.render_many([RepresentMe(), RepresentMe()])
+
+        # the default hook loads nothing
+        self.assertIsNone(Entity.prefetch([], ()))
+
+        class UnprefetchedEntity(Entity):
+            _FIELDS_ = ['groups']
+
+            def groups(self):
+                return self.prefetched('groups')
+
+        with self.assertRaisesRegexp(KeyError, "UnprefetchedEntity has no _PREFETCH_ entry 'groups'"):
+            UnprefetchedEntity()()
+
+        class OntoObjectsEntity(UnprefetchedEntity):
+            _PREFETCH_ = ['groups']
+
+            @classmethod
+            def prefetch(cls, entities, related):
+                return None
+
+        with self.assertRaisesRegexp(KeyError, "Prefetch of OntoObjectsEntity returned no _PREFETCH_ entry 'groups'"):
+            OntoObjectsEntity()()
+
+class IOAuxObject(object):
+    """
+    Aux object whose lookups block until parties of them are waiting at once
+    """
+
+    def __init__(self, parties):
+        self.barrier = threading.Barrier(parties, timeout=5)
+
+    def lookup(self, value):
+        self.barrier.wait()
+        return value
+
+
+class IOEntity(Entity):
+    _FIELDS_ = ['haha', 'first', 'second', 'maybe', 'label']
+    _ALIAS_ = 'obj'
+    _AUX_OBJECTS_ = ['client']
+
+    @io_bound
+    def first(self):
+        return self.client.lookup('first')
+
+    @io_bound
+    def second(self):
+        return self.client.lookup('second %s' % self.haha)
+
+    @io_bound
+    def maybe(self):
+        if self.obj.foobar < 1:
+            raise SuppressField
+        return self.obj.foobar
+
+    def label(self):
+        return 'label %s' % self.first
+
+IO_EXPECTED_HASH = {
+    'haha' : 'hehe',
+    'first' : 'first',
+    'second' : 'second hehe',
+    'maybe' : 5,
+    'label' : 'label first',
+}
+
+
+@unittest.skipIf(concurrent is None, 'needs concurrent.futures')
+class IOBoundFieldTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # first and second block until both are running
+        ent = IOEntity(RepresentMe(), client=IOAuxObject(2))
+        result = ent()
+        self.assertEqual(result, IO_EXPECTED_HASH)
+        self.assertEqual(list(result), list(IOEntity._FIELDS_))
+        self.assertIsNone(ent._Entity__memo)
+
+        objs = [RepresentMe() for i in range(3)]
+        objs[1].foobar = 0
+        rendered = IOEntity.render_many(objs, client=IOAuxObject(6))
+        self.assertEqual(rendered[0], IO_EXPECTED_HASH)
+        self.assertNotIn('maybe', rendered[1])
+
+        # outside of a render, they run inline
+        self.assertEqual(IOEntity(objs[0], client=IOAuxObject(1)).second, 'second hehe')
+
+        class CompiledIOEntity(IOEntity):
+            _COMPILED_ = True
+
+        self.assertEqual(CompiledIOEntity(objs[0], client=IOAuxObject(2))(), IO_EXPECTED_HASH)
+
+        pyentity.set_io_pool_size(3)
+        try:
+            self.assertEqual(pyentity.io_pool()._max_workers, 3)
+            self.assertEqual(ent(), IO_EXPECTED_HASH)
+        finally:
+            pyentity.set_io_pool_size(8)
+
+
+@unittest.skipIf(concurrent is None, 'needs concurrent.futures')
+class IOBoundFieldErrorsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class FailingIOEntity(Entity):
+            _FIELDS_ = ['first', 'second']
+
+            @io_bound
+            def first(self):
+                time.sleep(0.05)
+                raise ValueError('first')
+
+            @io_bound
+            def second(self):
+                raise KeyError('second')
+
+        # the first failing field wins, not the first to fail
+        ent = FailingIOEntity()
+        with self.assertRaisesRegexp(ValueError, 'first'):
+            ent()
+        self.assertIsNone(ent._Entity__memo)
+
+        class SlowIOEntity(Entity):
+            _FIELDS_ = ['slow', 'missing']
+
+            @io_bound
+            def slow(self):
+                time.sleep(0.5)
+                return 'slow'
+
+            @io_bound
+            def missing(self):
+                return self._o.missing
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            SlowIOEntity(RepresentMe())(timeout=0.05)
+
+        with self.assertRaises(concurrent.futures.TimeoutError):
+            SlowIOEntity.render_many([RepresentMe()], timeout=0.05)
+
+        with self.assertRaisesRegexp(AttributeError, 'missing'):
+            SlowIOEntity(RepresentMe())()
+
+        for name in ('timeout', 'objects', 'klass', 'fp', 'obj'):
+            with self.assertRaisesRegexp(ValueError, 'render option %s' % name):
+                type(Entity)('OptionAuxEntity', (Entity,), {'_AUX_OBJECTS_' : [name]})
+
+
+@unittest.skipIf(concurrent is None, 'needs concurrent.futures')
+class IOBoundFieldNestedTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class InnerIOEntity(Entity):
+            _FIELDS_ = ['remote']
+
+            @io_bound
+            def remote(self):
+                time.sleep(0.01)
+                return self._o
+
+        class OuterIOEntity(Entity):
+            _FIELDS_ = ['inner']
+
+            @io_bound
+            def inner(self):
+                return InnerIOEntity.render_many(range(self._o), timeout=5)
+
+        # every thread of the pool renders an entity that has I/O-bound fields
+        pyentity.set_io_pool_size(2)
+        try:
+            self.assertEqual(OuterIOEntity.render_many(range(4), timeout=5), [
+                {'inner' : [{'remote' : i} for i in range(n)]}
+                for n in range(4)
+            ])
+            self.assertEqual(OuterIOEntity(3)(timeout=5)['inner'][2], {'remote' : 2})
+        finally:
+            pyentity.set_io_pool_size(8)
+
+def main_aux_objects():
+    """
+    Aux object factory of the sharded rendering workers
+    """
+    return {'aux_object' : AuxObject()}
+
+
+class RenderShardedTestCase(unittest.TestCase):
+
+    def runTest(self):
+        objs = [RepresentMe() for i in range(7)]
+        objs[3].foobar = 3
+
+        chunks = list(MainEntity.iter_render_sharded(
+            objs,
+            processes=2,
+            chunk_size=3,
+            aux_factory=main_aux_objects,
+        ))
+        self.assertEqual([len(chunk) for chunk in chunks], [3, 3, 1])
+        self.assertEqual(chunks[0][0], MAIN_EXPECTED_HASH)
+        self.assertEqual(chunks[1][0]['foobar'], 3)
+
+        self.assertEqual(list(EmptyFieldsEntity.iter_render_sharded([], processes=1)), [])
+
+        # errors in the workers come back to the caller
+        with self.assertRaisesRegexp(TypeError, 'Missing aux object'):
+            list(MainEntity.iter_render_sharded(objs, processes=1))
+
+class InstrumentationTestCase(unittest.TestCase):
+
+    def runTest(self):
+        recorded = []
+        def hook(klass, field, kind, elapsed, outcome):
+            recorded.append((klass, field, kind, outcome))
+
+        instrumentation = pyentity.enable_instrumentation(hook)
+        try:
+            obj = RepresentMe()
+            MainEntity(obj, aux_object=AuxObject())()
+
+            class CompiledSuppressingEntity(SuppressingEntity):
+                _COMPILED_ = True
+
+            obj.foobar = 0
+            CompiledSuppressingEntity(obj)()
+
+            stats = pyentity.instrumentation_snapshot()
+            self.assertEqual(stats[MainEntity, 'haha']['kind'], 'proxy')
+            self.assertEqual(stats[MainEntity, 'ent_method']['kind'], 'method')
+            self.assertEqual(stats[MainEntity, 'snow']['calls'], 1)
+            self.assertEqual(stats[CompiledSuppressingEntity, 'foobar']['suppressed'], 1)
+            self.assertEqual(stats[CompiledSuppressingEntity, 'hello']['suppressed'], 0)
+
+            entry = stats[MainEntity, 'a_value']
+            self.assertGreaterEqual(entry['total_time'], entry['max_time'])
+            self.assertGreater(entry['max_time'], 0)
+
+            self.assertEqual(len(recorded), len(stats))
+            self.assertIn((CompiledSuppressingEntity, 'foobar', 'method', 'suppressed'), recorded)
+
+            pyentity.reset_instrumentation()
+            self.assertEqual(pyentity.instrumentation_snapshot(), {})
+        finally:
+            self.assertIs(pyentity.disable_instrumentation(), instrumentation)
+
+        MainEntity(obj, aux_object=AuxObject())()
+        self.assertEqual(pyentity.instrumentation_snapshot(), {})
+        self.assertIs(pyentity.resolve_field, pyentity.untimed_resolve_field)
+
+class MemoizingEntity(Entity):
+    _FIELDS_ = ['name', 'label', 'maybe', 'maybe_label']
+    _ALIAS_ = 'obj'
+
+    def name(self):
+        self.obj.name_calls += 1
+        return 'name%d' % self.obj.foobar
+
+    def label(self):
+        return 'label %s' % self.name
+
+    def maybe(self):
+        self.obj.maybe_calls += 1
+        if self.obj.foobar < 1:
+            raise SuppressField
+        return self.obj.foobar
+
+    def maybe_label(self):
+        try:
+            return 'maybe %s' % self.maybe
+        except AttributeError:
+            return 'maybe not'
+
+
+def counted_obj():
+    obj = RepresentMe()
+    obj.name_calls = 0
+    obj.maybe_calls = 0
+    return obj
+
+
+class MemoizedRenderTestCase(unittest.TestCase):
+
+    def assertMemoized(self, klass):
+        obj = counted_obj()
+        ent = klass(obj)
+
+        self.assertEqual(ent(), {
+            'name' : 'name5',
+            'label' : 'label name5',
+            'maybe' : 5,
+            'maybe_label' : 'maybe 5',
+        })
+        self.assertEqual((obj.name_calls, obj.maybe_calls), (1, 1))
+
+        # separate renders never share values
+        obj.foobar = 0
+        self.assertEqual(dict(ent), {
+            'name' : 'name0',
+            'label' : 'label name0',
+            'maybe_label' : 'maybe not',
+        })
+        self.assertEqual((obj.name_calls, obj.maybe_calls), (2, 2))
+
+        # outside of a render, nothing is memoized
+        ent.label
+        ent.label
+        self.assertEqual(obj.name_calls, 4)
+
+    def runTest(self):
+        class CompiledMemoizingEntity(MemoizingEntity):
+            _COMPILED_ = True
+
+        self.assertMemoized(MemoizingEntity)
+        self.assertMemoized(CompiledMemoizingEntity)
+
+
+class InvalidateTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class InvalidatingEntity(MemoizingEntity):
+            _FIELDS_ = ['name', 'fresh_label']
+
+            def fresh_label(self):
+                self.obj.foobar = 6
+                self.invalidate('name')
+                return 'label %s' % self.name
+
+        obj = counted_obj()
+        self.assertEqual(InvalidatingEntity(obj)(), {
+            'name' : 'name5',
+            'fresh_label' : 'label name6',
+        })
+        self.assertEqual(obj.name_calls, 2)
+
+        # does nothing outside of a render
+        InvalidatingEntity(obj).invalidate()
+
+
+class RebindTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class StashingEntity(MainEntity):
+            _FIELDS_ = MainEntity._FIELDS_ + ['stash']
+
+            def stash(self):
+                # state a field method leaves on the entity
+                seen = self.__dict__.get('seen', 0)
+                self.seen = seen + 1
+                return seen
+
+        class SlottedStashingEntity(pyentity.SlottedEntity):
+            _FIELDS_ = ['foobar', 'stash']
+            _DESCRIPTORS_ = True
+            __slots__ = ('__seen',)
+
+            def stash(self):
+                try:
+                    seen = self.__seen
+                except AttributeError:
+                    seen = 0
+                self.__seen = seen + 1
+                return seen
+
+        aux = AuxObject()
+        ent = StashingEntity(RepresentMe(), aux_object=aux)
+        slotted = SlottedStashingEntity(RepresentMe())
+        for i in range(3):
+            obj = RepresentMe()
+            obj.foobar = i
+
+            self.assertIs(ent.rebind(obj), ent)
+            self.assertIs(ent.wrapped, obj)
+            self.assertIs(ent.aux_object, aux)
+            self.assertEqual(ent()['foobar'], i)
+            self.assertEqual(ent()['stash'], 1)
+
+            self.assertEqual(slotted.rebind(obj)(), {'foobar' : i, 'stash' : 0})
+
+        class DescriptorStashingEntity(StashingEntity):
+            _DESCRIPTORS_ = True
+            _COMPILED_ = True
+
+        ent = DescriptorStashingEntity(RepresentMe(), aux_object=aux)
+        ent()
+        obj = RepresentMe()
+        obj.foobar = 7
+        ent.rebind(obj)
+        self.assertIs(ent.wrapped, obj)
+        self.assertEqual(ent()['stash'], 0)
+        self.assertEqual(ent.encode(only=['foobar']), b'{"foobar":7}')
+
+        # a class with its own __init__ goes through it again
+        class CustomInitEntity(SuppressingEntity):
+            def __init__(self, obj):
+                self.label = 'bound %s' % obj.foobar
+                super(CustomInitEntity, self).__init__(obj)
+
+        ent = CustomInitEntity(RepresentMe())
+        obj.foobar = 0
+        ent.rebind(obj)
+        self.assertEqual(ent.__dict__['label'], 'bound 0')
+        self.assertEqual(ent(), {'hello' : 7, 'a_value' : 100})
+
+        class RebindingEntity(Entity):
+            _FIELDS_ = ['rebound']
+
+            def rebound(self):
+                return self.rebind(None)
+
+        with self.assertRaisesRegexp(ValueError, 'during a render'):
+            RebindingEntity()()
+
+
+class ProjectionTestCase(unittest.TestCase):
+
+    def assertProjects(self, klass):
+        obj = counted_obj()
+        ent = klass(obj)
+
+        # excluded fields are not resolved at all
+        self.assertEqual(ent(only=['maybe', 'name']), {'name' : 'name5', 'maybe' : 5})
+        self.assertEqual((obj.name_calls, obj.maybe_calls), (1, 1))
+
+        self.assertEqual(ent(exclude=['name', 'maybe', 'maybe_label']), {'label' : 'label name5'})
+        self.assertEqual((obj.name_calls, obj.maybe_calls), (2, 1))
+
+        self.assertEqual(ent(only=['label', 'maybe'], exclude=['maybe']), {'label' : 'label name5'})
+        self.assertEqual(ent(only=[]), {})
+        self.assertEqual(ent(), {
+            'name' : 'name5',
+            'label' : 'label name5',
+            'maybe' : 5,
+            'maybe_label' : 'maybe 5',
+        })
+
+        self.assertEqual(
+            klass.render_many([obj, obj], only=('name',)),
+            [{'name' : 'name5'}, {'name' : 'name5'}],
+        )
+
+        with self.assertRaisesRegexp(ValueError, 'Unknown field nope'):
+            ent(exclude=['nope'])
+
+    def runTest(self):
+        class CompiledMemoizingEntity(MemoizingEntity):
+            _COMPILED_ = True
+
+        self.assertProjects(MemoizingEntity)
+        self.assertProjects(CompiledMemoizingEntity)
+
+        # projections are cached
+        plan = MemoizingEntity._Entity__plan
+        projection = plan.project(MemoizingEntity, ['name', 'label'])
+        self.assertIs(plan.project(MemoizingEntity, ('label', 'name')), projection)
+        self.assertEqual(projection.fields, ('name', 'label'))
+        self.assertEqual(plan.fields, tuple(MemoizingEntity._FIELDS_))
+
+
+def version_key(obj, aux):
+    if obj.version is None:
+        return None
+    return (obj.foobar, obj.version)
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def runTest(self):
+        cache = pyentity.RenderCache(version_key, max_size=2)
+
+        class CachedEntity(MemoizingEntity):
+            _FIELDS_ = ['name', 'tags']
+            _CACHE_ = cache
+
+            def tags(self):
+                return ['a', 'b']
+
+        obj = counted_obj()
+        obj.version = 1
+        ent = CachedEntity(obj)
+
+        first = ent()
+        self.assertEqual(first, {'name' : 'name5', 'tags' : ['a', 'b']})
+        first['tags'].append('corrupted')
+
+        # cached, and not an alias of what another caller got
+        second = ent()
+        self.assertEqual(second, {'name' : 'name5', 'tags' : ['a', 'b']})
+        self.assertIsNot(ent(), second)
+        self.assertEqual(obj.name_calls, 1)
+        self.assertEqual(cache.stats(), {'hits' : 2, 'misses' : 1, 'size' : 1})
+
+        # projections and classes are cached apart
+        self.assertEqual(ent(only=['tags']), {'tags' : ['a', 'b']})
+
+        class OtherCachedEntity(CachedEntity):
+            _FIELDS_ = ['name']
+
+        self.assertEqual(OtherCachedEntity(obj)(), {'name' : 'name5'})
+        self.assertEqual(obj.name_calls, 2)
+
+        # a new version is a new key
+        obj.version = 2
+        ent()
+        self.assertEqual(obj.name_calls, 3)
+
+        # explicit invalidation
+        cache.invalidate((5, 2))
+        ent()
+        self.assertEqual(obj.name_calls, 4)
+
+        # least recently used keys are evicted
+        obj.version = 1
+        ent()
+        obj.version = 3
+        ent()
+        self.assertEqual(obj.name_calls, 5)
+        obj.version = 1
+        ent()
+        self.assertEqual(obj.name_calls, 5)
+        obj.version = 2
+        ent()
+        self.assertEqual(obj.name_calls, 6)
+
+        # a key of None is not cached
+        obj.version = None
+        ent()
+        ent()
+        self.assertEqual(obj.name_calls, 8)
+
+        objs = [counted_obj() for i in range(3)]
+        for other in objs:
+            other.version = 4
+        CachedEntity.render_many(objs)
+        self.assertEqual(CachedEntity.render_many(objs), [{'name' : 'name5', 'tags' : ['a', 'b']}] * 3)
+        self.assertEqual([other.name_calls for other in objs], [1, 0, 0])
+
+        cache.invalidate()
+        self.assertEqual(cache.stats()['size'], 0)
+
+        with self.assertRaisesRegexp(ValueError, 'must be a RenderCache'):
+            class BadCacheEntity(Entity):
+                _CACHE_ = {}
+
+
+@unittest.skipIf(concurrent is None, 'needs concurrent.futures')
+class CacheManyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # cache hits skip the batched and I/O-bound fields of their chunk
+        calls = []
+
+        class CachedBatchedEntity(Entity):
+            _FIELDS_ = ['foobar', 'batch', 'remote']
+            _CACHE_ = pyentity.RenderCache(version_key)
+            _BATCH_SIZE_ = 4
+
+            @batched
+            def batch(cls, entities):
+                calls.append(('batch', len(entities)))
+                return ['batch'] * len(entities)
+
+            @io_bound
+            def remote(self):
+                calls.append(('remote', 1))
+                return 'remote'
+
+        objs = [counted_obj() for i in range(5)]
+        for i, other in enumerate(objs):
+            other.foobar = i
+            other.version = 1
+        expected = [{'foobar' : i, 'batch' : 'batch', 'remote' : 'remote'} for i in range(5)]
+
+        self.assertEqual(CachedBatchedEntity.render_many(objs), expected)
+        self.assertEqual(calls.count(('remote', 1)), 5)
+        self.assertEqual(sorted(call for call in calls if call[0] == 'batch'), [('batch', 1), ('batch', 4)])
+
+        del calls[:]
+        objs[3].version = 2
+        self.assertEqual(CachedBatchedEntity.render_many(objs), expected)
+        self.assertEqual(calls, [('batch', 1), ('remote', 1)])
+        self.assertEqual(CachedBatchedEntity._CACHE_.stats()['hits'], 4)
+
+
+class CacheTTLTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class ExpiringEntity(MemoizingEntity):
+            _FIELDS_ = ['name']
+            _CACHE_ = pyentity.RenderCache(version_key, ttl=0.05, copy=dict)
+
+        obj = counted_obj()
+        obj.version = 1
+        ent = ExpiringEntity(obj)
+
+        ent()
+        ent()
+        self.assertEqual(obj.name_calls, 1)
+        time.sleep(0.06)
+        ent()
+        self.assertEqual(obj.name_calls, 2)
+
+
+class Profile(object):
+
+    def __init__(self):
+        self.name = 'George'
+        self.bio = 'President'
+        self.phone = None
+        self.version = 1
+        self.bio_calls = 0
+
+
+class ProfileEntity(Entity):
+    _FIELDS_ = ['name', 'bio', 'phone', 'summary']
+    _ALIAS_ = 'profile'
+    _VERSIONS_ = {'bio' : 'profile_version', 'summary' : 'profile_version'}
+
+    def profile_version(self):
+        return self.profile.version
+
+    def bio(self):
+        self.profile.bio_calls += 1
+        return self.profile.bio.upper()
+
+    def phone(self):
+        if self.profile.phone is None:
+            return pyentity.SUPPRESS
+        return self.profile.phone
+
+    def summary(self):
+        return '%s: %s' % (self.name, self.bio)
+
+
+class DiffTestCase(unittest.TestCase):
+
+    def runTest(self):
+        profile = Profile()
+        ent = ProfileEntity(profile)
+
+        snapshot, changed, removed = ent.diff()
+        self.assertEqual(changed, {
+            'name' : 'George',
+            'bio' : 'PRESIDENT',
+            'summary' : 'George: PRESIDENT',
+        })
+        self.assertEqual(removed, [])
+        self.assertEqual(snapshot.values, changed)
+        self.assertEqual(snapshot.versions, {'bio' : 1, 'summary' : 1})
+        self.assertEqual(profile.bio_calls, 1)
+
+        # the version is the same, so bio is not resolved again,
+        # even if it would have changed
+        profile.bio = 'General'
+        profile.phone = '555'
+        snapshot, changed, removed = ent.diff(snapshot)
+        self.assertEqual(changed, {'phone' : '555'})
+        self.assertEqual(snapshot.values['bio'], 'PRESIDENT')
+        self.assertEqual(profile.bio_calls, 1)
+
+        profile.version = 2
+        profile.phone = None
+        snapshot, changed, removed = ent.diff(snapshot)
+        self.assertEqual(changed, {'bio' : 'GENERAL', 'summary' : 'George: GENERAL'})
+        self.assertEqual(removed, ['phone'])
+        self.assertEqual(snapshot.values, ent())
+        self.assertEqual(profile.bio_calls, 3)
+
+        # against a plain rendered dictionary, everything is resolved
+        previous = ent()
+        profile.name = 'Martha'
+        snapshot, changed, removed = ent.diff(previous)
+        self.assertEqual(changed, {'name' : 'Martha', 'summary' : 'Martha: GENERAL'})
+
+        # only the fields of the projection are compared
+        snapshot, changed, removed = ent.diff(snapshot, only=['name', 'phone'])
+        self.assertEqual((changed, removed), ({}, []))
+        self.assertEqual(snapshot.versions, {})
+
+        # a reused suppression stays suppressed
+        class SuppressedBioEntity(ProfileEntity):
+            def bio(self):
+                return pyentity.SUPPRESS
+
+            summary = 'no bio'
+
+        snapshot, changed, removed = SuppressedBioEntity(profile).diff()
+        profile.bio = 'Farmer'
+        self.assertEqual(SuppressedBioEntity(profile).diff(snapshot)[1:], ({}, []))
+
+        # snapshots are plain data
+        self.assertEqual(pickle.loads(pickle.dumps(snapshot)), snapshot)
+
+        # a versioned field proxied to a property is not read again either
+        class CountedProfile(Profile):
+            @property
+            def headline(self):
+                self.bio_calls += 1
+                return self.bio
+
+        class ProxiedProfileEntity(Entity):
+            _FIELDS_ = ['name', 'headline', 'version']
+            _VERSIONS_ = {'headline' : 'headline_version'}
+
+            def headline_version(self):
+                return self._o.version
+
+        class CompiledProxiedProfileEntity(ProxiedProfileEntity):
+            _COMPILED_ = True
+
+        for klass in (ProxiedProfileEntity, CompiledProxiedProfileEntity):
+            profile = CountedProfile()
+            ent = klass(profile)
+            snapshot = ent.diff()[0]
+            profile.bio = 'General'
+            snapshot, changed, removed = ent.diff(snapshot)
+            self.assertEqual((changed, removed), ({}, []))
+            self.assertEqual(snapshot.values['headline'], 'President')
+            self.assertEqual(profile.bio_calls, 1)
+
+        with self.assertRaisesRegexp(ValueError, 'unknown field'):
+            class UnknownVersionedEntity(ProfileEntity):
+                _VERSIONS_ = {'email' : 'profile_version'}
+
+        with self.assertRaisesRegexp(ValueError, 'not a method'):
+            class MissingVersionEntity(ProfileEntity):
+                _VERSIONS_ = {'bio' : 'bio_version'}
+
+
+class Writer(object):
+    """
+    Collects what is written to it, like a file
+    """
+
+    def __init__(self):
+        self.writes = []
+
+    def write(self, data):
+        self.writes.append(data)
+
+
+def send_through_socket(send):
+    """
+    Calls send with one end of a real socket pair,
+    returning what it returned and all the bytes read from the other end
+    """
+    sender, receiver = socket.socketpair()
+    received = []
+
+    def receive():
+        data = receiver.recv(65536)
+        while data:
+            received.append(data)
+            data = receiver.recv(65536)
+
+    thread = threading.Thread(target=receive)
+    thread.start()
+    try:
+        result = send(sender)
+    finally:
+        sender.shutdown(socket.SHUT_WR)
+        thread.join()
+        sender.close()
+        receiver.close()
+
+    return result, b''.join(received)
+
+
+class IterencodeTestCase(unittest.TestCase):
+
+    def runTest(self):
+        obj = RepresentMe()
+        ent = MainEntity(obj, aux_object=AuxObject())
+
+        encoded = ''.join(pyentity.iterencode(ent))
+        self.assertEqual(json.loads(encoded), MAIN_EXPECTED_HASH)
+        self.assertTrue(encoded.startswith('{"snow": "COLD", "haha": "hehe"'))
+
+        self.assertEqual(''.join(pyentity.iterencode(EmptyFieldsEntity())), '{}')
+        self.assertEqual(''.join(pyentity.iterencode([])), '[]')
+
+        compact = ''.join(pyentity.iterencode(SuppressingEntity(obj), separators=(',', ':')))
+        self.assertEqual(compact, '{"hello":7,"foobar":5,"a_value":100}')
+
+        with self.assertRaisesRegexp(ValueError, 'indent'):
+            pyentity.iterencode(ent, indent=2)
+
+
+class IterencodeManyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        rendered = []
+
+        def entities():
+            for i in range(3):
+                rendered.append(i)
+                yield ChildEntity(RepresentMe())
+
+        chunks = pyentity.iterencode(entities())
+        self.assertEqual(next(chunks), '[')
+        self.assertEqual(rendered, [0])
+
+        self.assertEqual(json.loads('[' + ''.join(chunks)), [CHILD_EXPECTED_HASH] * 3)
+
+        # rendered dictionaries work too
+        dicts = ChildEntity.iter_render_many([RepresentMe()])
+        self.assertEqual(json.loads(''.join(pyentity.iterencode(dicts))), [CHILD_EXPECTED_HASH])
+
+
+class DumpTestCase(unittest.TestCase):
+
+    def runTest(self):
+        objs = [RepresentMe() for i in range(10)]
+
+        writer = Writer()
+        pyentity.dump(ChildEntity.iter_render_many(objs), writer, buffer_size=100)
+        self.assertTrue(len(writer.writes) > 1)
+        self.assertTrue(all(len(data) < 400 for data in writer.writes))
+        self.assertEqual(json.loads(''.join(writer.writes)), [CHILD_EXPECTED_HASH] * 10)
+
+        _, sent = send_through_socket(lambda sock: pyentity.dump((ChildEntity(obj) for obj in objs), sock))
+        self.assertEqual(json.loads(sent.decode('utf-8')), [CHILD_EXPECTED_HASH] * 10)
+
+        # binary files get UTF-8
+        fp = io.BytesIO()
+        pyentity.dump([{'name' : u'\u00e9t\u00e9'}], fp, ensure_ascii=False)
+        self.assertEqual(fp.getvalue(), u'[{"name": "\u00e9t\u00e9"}]'.encode('utf-8'))
+
+
+class RowTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CompiledSuppressingEntity(SuppressingEntity):
+            _COMPILED_ = True
+
+        objs = [RepresentMe(), RepresentMe()]
+        objs[1].foobar = 0
+
+        for klass in (SuppressingEntity, CompiledSuppressingEntity):
+            self.assertEqual(klass(objs[0]).row(), (7, 5, 100))
+            self.assertEqual(klass(objs[1]).row(), (7, pyentity.SUPPRESS, 100))
+            self.assertEqual(klass(objs[0]).row(exclude=['hello']), (5, 100))
+
+            self.assertEqual(klass.render_rows(objs), (
+                ('hello', 'foobar', 'a_value'),
+                [(7, 5, 100), (7, pyentity.SUPPRESS, 100)],
+            ))
+            self.assertEqual(klass.render_columns(objs, only=['foobar', 'a_value']), (
+                ('foobar', 'a_value'),
+                [[5, pyentity.SUPPRESS], [100, 100]],
+            ))
+            self.assertEqual(list(klass.iter_render_rows(objs[:1])), [(7, 5, 100)])
+
+        ent = MainEntity(RepresentMe(), aux_object=AuxObject())
+        self.assertEqual(ent.row(), tuple(MAIN_EXPECTED_HASH[field] for field in MainEntity._FIELDS_))
+        self.assertIsNone(ent._Entity__memo)
+        self.assertEqual(EmptyFieldsEntity().row(), ())
+
+        self.assertIs(pickle.loads(pickle.dumps(pyentity.SUPPRESS)), pyentity.SUPPRESS)
+
+
+class RawJSONTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class SettingsEntity(Entity):
+            _FIELDS_ = ['haha', 'settings', 'blob', 'view']
+
+            def settings(self):
+                return pyentity.RawJSON('{"theme": "dark", "tabs": [1, 2]}')
+
+            def blob(self):
+                return pyentity.RawJSON(b'[true, null]')
+
+            def view(self):
+                return pyentity.RawJSON(memoryview(b'{"nested": {"a": "\xc3\xa9"}}'))
+
+        expected = {
+            'haha' : 'hehe',
+            'settings' : {'theme' : 'dark', 'tabs' : [1, 2]},
+            'blob' : [True, None],
+            'view' : {'nested' : {'a' : u'\xe9'}},
+        }
+
+        ent = SettingsEntity(RepresentMe())
+        encoded = ''.join(pyentity.iterencode(ent))
+        self.assertIn('"settings": {"theme": "dark", "tabs": [1, 2]}', encoded)
+        self.assertEqual(json.loads(encoded), expected)
+
+        # rendered dictionaries and arrays too
+        self.assertEqual(json.loads(''.join(pyentity.iterencode(SettingsEntity.iter_render_many([RepresentMe()])))), [expected])
+
+        writer = Writer()
+        SettingsEntity.export([RepresentMe()], writer)
+        self.assertEqual(json.loads(''.join(writer.writes)), expected)
+
+        self.assertEqual(ent.settings.load(), expected['settings'])
+        self.assertEqual(ent.blob, pyentity.RawJSON('[true, null]'))
+
+
+class EncodedEntity(Entity):
+    _FIELDS_ = ['snow', 'haha', 'foobar', 'rate', 'flags', 'nothing', 'name', 'raw', 'maybe', 'gone']
+
+    snow = 'COLD'
+    flags = {'on' : True}
+    nothing = None
+    gone = pyentity.SUPPRESS
+
+    def rate(self):
+        return 0.5
+
+    def name(self):
+        return u'Jos\xe9 "the" \\ \u2603'
+
+    def raw(self):
+        return pyentity.RawJSON(b'[1,2]')
+
+    def maybe(self):
+        if self._o.foobar < 1:
+            return pyentity.SUPPRESS
+        return self._o.foobar > 1
+
+ENCODED_EXPECTED = (
+    u'{"snow":"COLD","haha":"hehe","foobar":5,"rate":0.5,"flags":{"on":true},'
+    u'"nothing":null,"name":"Jos\xe9 \\"the\\" \\\\ \u2603","raw":[1,2],"maybe":true}'
+).encode('utf-8')
+
+if str is bytes:
+    # Python 2 escapes non-ASCII characters
+    ENCODED_EXPECTED = ENCODED_EXPECTED.replace('\xc3\xa9', '\\u00e9').replace('\xe2\x98\x83', '\\u2603')
+
+class EncodeTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CompiledEncodedEntity(EncodedEntity):
+            _COMPILED_ = True
+
+        obj = RepresentMe()
+        for klass in (EncodedEntity, CompiledEncodedEntity):
+            encoded = klass(obj).encode()
+            self.assertIsInstance(encoded, bytes)
+            self.assertEqual(encoded, ENCODED_EXPECTED)
+
+        # the generic path, while instrumented, gives the same bytes
+        pyentity.enable_instrumentation()
+        try:
+            self.assertEqual(EncodedEntity(obj).encode(), ENCODED_EXPECTED)
+        finally:
+            pyentity.disable_instrumentation()
+
+        for klass, expected in ((MainEntity, MAIN_EXPECTED_HASH), (ChildEntity, CHILD_EXPECTED_HASH)):
+            ent = klass(obj, **dict((name, AuxObject()) for name in klass._AUX_OBJECTS_))
+            self.assertEqual(json.loads(ent.encode().decode('utf-8')), expected)
+
+        self.assertEqual(EncodedEntity(obj).encode(only=['foobar', 'gone']), b'{"foobar":5}')
+        self.assertEqual(EncodedEntity(obj).encode(exclude=EncodedEntity._FIELDS_), b'{}')
+
+        suppressed = RepresentMe()
+        suppressed.foobar = 0
+        encoded = list(EncodedEntity.iter_encode_many([obj, suppressed], only=['foobar', 'maybe']))
+        self.assertEqual(encoded, [b'{"foobar":5,"maybe":true}', b'{"foobar":0}'])
+
+        # batched fields, and the cache, which keeps the bytes apart
+        class BatchedEncodedEntity(Entity):
+            _FIELDS_ = ['haha', 'batch']
+            _CACHE_ = pyentity.RenderCache(lambda obj, aux: id(obj))
+
+            @batched
+            def batch(cls, entities):
+                return [len(entities)] * len(entities)
+
+        self.assertEqual(list(BatchedEncodedEntity.iter_encode_many([obj, suppressed])), [
+            b'{"haha":"hehe","batch":2}',
+            b'{"haha":"hehe","batch":2}',
+        ])
+        # the bytes come from the cache, the dictionary does not
+        ent = BatchedEncodedEntity(obj)
+        self.assertEqual(ent.encode(), b'{"haha":"hehe","batch":2}')
+        self.assertEqual(ent(), {'haha' : 'hehe', 'batch' : 1})
+
+        # a constant RawJSON field is spliced in, as it is when rendered
+        class RawConstantEntity(Entity):
+            _FIELDS_ = ['cfg', 'haha']
+            _CACHE_ = pyentity.RenderCache(lambda obj, aux: id(obj))
+            cfg = pyentity.RawJSON('{"a":1}')
+
+        class CompiledRawConstantEntity(RawConstantEntity):
+            _COMPILED_ = True
+
+        for klass in (RawConstantEntity, CompiledRawConstantEntity):
+            self.assertEqual(klass(obj).encode(), b'{"cfg":{"a":1},"haha":"hehe"}')
+            self.assertEqual(list(klass.iter_encode_many([obj])), [b'{"cfg":{"a":1},"haha":"hehe"}'])
+
+        with self.assertRaisesRegexp(TypeError, 'serializable'):
+            class UnencodableEntity(Entity):
+                _FIELDS_ = ['value']
+                value = object()
+
+            UnencodableEntity().encode()
+
+
+class ExportTestCase(unittest.TestCase):
+
+    def runTest(self):
+        read = []
+
+        def rows(count):
+            for i in range(count):
+                obj = RepresentMe()
+                obj.foobar = i
+                read.append(i)
+                yield obj
+
+        progress = []
+        writer = Writer()
+        written = SuppressingEntity.export(rows(50), writer, buffer_size=100, progress=progress.append)
+
+        self.assertEqual(written, 50)
+        self.assertTrue(len(writer.writes) > 1)
+        self.assertEqual(len(progress), len(writer.writes))
+        self.assertEqual(progress[-1], 50)
+
+        lines = ''.join(writer.writes).splitlines()
+        self.assertEqual(len(lines), 50)
+        self.assertEqual(lines[0], '{"hello":7,"a_value":100}')
+        self.assertEqual(lines[3], '{"hello":7,"foobar":3,"a_value":100}')
+
+        # rows are read as they are written
+        read[:] = []
+        chunks = []
+        class Lazy(object):
+            def write(self, data):
+                chunks.append(len(read))
+        SuppressingEntity.export(rows(20), Lazy(), buffer_size=1)
+        self.assertEqual(chunks[:3], [1, 2, 3])
+
+
+class ExportCSVTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class CSVEntity(MainEntity):
+            _FIELDS_ = ['snow', 'foobar', 'tags', 'nothing', 'maybe']
+
+            tags = ['a', 'b']
+            nothing = None
+
+            def maybe(self):
+                if self.wrapped.foobar < 1:
+                    raise SuppressField
+                return 'yes, "maybe"'
+
+        objs = [RepresentMe(), RepresentMe()]
+        objs[1].foobar = 0
+
+        written, sent = send_through_socket(
+            lambda sock: CSVEntity.export(objs, sock, format='csv', aux_object=AuxObject()),
+        )
+        self.assertEqual(written, 2)
+        self.assertEqual(sent.decode('utf-8').splitlines(), [
+            'snow,foobar,tags,nothing,maybe',
+            'COLD,5,"[""a"",""b""]",,"yes, ""maybe"""',
+            'COLD,0,"[""a"",""b""]",,',
+        ])
+
+        # headers follow the projection
+        writer = Writer()
+        CSVEntity.export(objs, writer, format='csv', only=['foobar', 'snow'], aux_object=AuxObject())
+        self.assertEqual(''.join(writer.writes).splitlines()[0], 'snow,foobar')
+
+        with self.assertRaisesRegexp(ValueError, 'Unknown export format'):
+            CSVEntity.export(objs, writer, format='xml', aux_object=AuxObject())
+
+class SlottedTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class SlottedMainEntity(pyentity.SlottedEntity):
+            _FIELDS_ = MainEntity._FIELDS_
+            _ALIAS_ = MainEntity._ALIAS_
+            _AUX_OBJECTS_ = MainEntity._AUX_OBJECTS_
+
+            snow = 'COLD'
+            ent_method = MainEntity.__dict__['ent_method']
+            ent_alias_method = MainEntity.__dict__['ent_alias_method']
+            aux_object_method = MainEntity.__dict__['aux_object_method']
+
+        class SlottedChildEntity(SlottedMainEntity):
+            _FIELDS_ = ['snow', 'ent_alias_method']
+
+        obj = RepresentMe()
+        aux = AuxObject()
+
+        for klass in (SlottedMainEntity, SlottedChildEntity):
+            ent = klass(obj, aux_object=aux)
+            self.assertFalse(hasattr(ent, '__dict__'))
+            with self.assertRaises(AttributeError):
+                ent.anything_else = 1
+
+        self.assertEqual(SlottedMainEntity(obj, aux_object=aux)(), MAIN_EXPECTED_HASH)
+        self.assertEqual(SlottedChildEntity.render_many([obj], aux_object=aux), [{
+            'snow' : 'COLD',
+            'ent_alias_method' : 'echoWRAP',
+        }])
+
+class DescriptorMainEntity(MainEntity):
+    _DESCRIPTORS_ = True
+
+
+class DescriptorsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        obj = RepresentMe()
+        aux = AuxObject()
+        ent = DescriptorMainEntity(obj, aux_object=aux)
+
+        self.assertIs(type(ent).__getattribute__, object.__getattribute__)
+        self.assertEqual(ent(), MAIN_EXPECTED_HASH)
+        self.assertEqual(dict(ent), MAIN_EXPECTED_HASH)
+        self.assertEqual(ent.snow, 'COLD')
+        self.assertEqual(ent.haha, 'hehe')
+        self.assertEqual(ent.ent_alias_method, 'echoWRAP')
+        self.assertEqual(ent['foobar'], 5)
+        self.assertIs(ent.wrapped, obj)
+        self.assertIs(ent._o, obj)
+        self.assertIs(ent.aux_object, aux)
+        self.assertEqual(ent._AUX_OBJECTS_, {'aux_object' : aux})
+        self.assertEqual(DescriptorMainEntity._AUX_OBJECTS_, ['aux_object'])
+
+        with self.assertRaises(AttributeError):
+            ent.idontexist
+        # class attributes and methods that are not fields stay hidden
+        for attr in ('fire', 'helper'):
+            with self.assertRaisesRegexp(AttributeError, 'Entity DescriptorMainEntity has no field %s' % attr):
+                getattr(ent, attr)
+        self.assertEqual(DescriptorMainEntity.fire, 'HOT')
+        self.assertEqual(DescriptorMainEntity.helper(ent), 'helped')
+        with self.assertRaisesRegexp(AttributeError, 'Cannot set'):
+            ent.snow = 'WARM'
+        with self.assertRaisesRegexp(AttributeError, 'Cannot set'):
+            ent.wrapped = None
+
+
+class DescriptorsSuppressedTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class DescriptorSuppressingEntity(SuppressingEntity):
+            _DESCRIPTORS_ = True
+
+        obj = RepresentMe()
+        ent = DescriptorSuppressingEntity(obj)
+        self.assertEqual(ent.foobar, 5)
+
+        obj.foobar = 0
+        with self.assertRaisesRegexp(AttributeError, 'suppressed'):
+            ent.foobar
+        self.assertEqual(ent(), {'hello' : 7, 'a_value' : 100})
+
+
+class DescriptorsInheritanceTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class DescriptorChildEntity(DescriptorMainEntity):
+            _FIELDS_ = ['snow', 'ent_method', 'subent_method']
+            _ALIAS_ = 'other'
+            _AUX_OBJECTS_ = []
+
+            def subent_method(self):
+                return self.other.a_method('SUB')
+
+        class PlainChildEntity(DescriptorChildEntity):
+            _DESCRIPTORS_ = False
+
+            def ent_method(self):
+                return self.other.a_method('PLAIN')
+
+        obj = RepresentMe()
+        ent = DescriptorChildEntity(obj)
+
+        self.assertEqual(ent(), {
+            'snow' : 'COLD',
+            'ent_method' : 'echo',
+            'subent_method' : 'SUB',
+        })
+        # the fields, alias and aux objects of the base class are not ours
+        for attr in ('haha', 'wrapped', 'aux_object'):
+            with self.assertRaisesRegexp(AttributeError, 'no field'):
+                getattr(ent, attr)
+
+        plain = PlainChildEntity(obj)
+        self.assertIsNot(type(plain).__getattribute__, object.__getattribute__)
+        self.assertEqual(plain(), {
+            'snow' : 'COLD',
+            'ent_method' : 'PLAIN',
+            'subent_method' : 'SUB',
+        })
+        with self.assertRaisesRegexp(AttributeError, 'no field'):
+            plain.haha
 
 class CuteWrongArgTypeTestCase(unittest.TestCase):
 
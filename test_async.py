@@ -0,0 +1,258 @@
+"""
+Tests of async rendering, Python 3 only
+"""
+import asyncio
+import unittest
+
+from pyentity import Entity, SuppressField
+
+from test import (
+    RepresentMe,
+    AuxObject,
+    MainEntity,
+    MAIN_EXPECTED_HASH,
+)
+
+########################################
+# Test Fixtures
+
+class Tracker(object):
+    """
+    Aux object counting how many awaits are running at once
+    """
+
+    def __init__(self):
+        self.running = 0
+        self.max_running = 0
+        self.calls = 0
+
+    async def fetch(self, value):
+        self.calls += 1
+        self.running += 1
+        self.max_running = max(self.max_running, self.running)
+        await asyncio.sleep(0.01)
+        self.running -= 1
+        return value
+
+
+class AsyncEntity(Entity):
+    _FIELDS_ = ['haha', 'slow', 'slower', 'maybe', 'label', 'foobar']
+    _ALIAS_ = 'obj'
+    _AUX_OBJECTS_ = ['tracker']
+
+    async def slow(self):
+        return await self.tracker.fetch('slow')
+
+    async def slower(self):
+        return await self.tracker.fetch('slower')
+
+    async def maybe(self):
+        value = await self.tracker.fetch(self.obj.foobar)
+        if value < 1:
+            raise SuppressField
+        return value
+
+    async def label(self):
+        return 'label %s' % (await self.slow)
+
+ASYNC_EXPECTED_HASH = {
+    'haha' : 'hehe',
+    'slow' : 'slow',
+    'slower' : 'slower',
+    'maybe' : 5,
+    'label' : 'label slow',
+    'foobar' : 5,
+}
+
+
+class FailingEntity(Entity):
+    _FIELDS_ = ['ok', 'first', 'second']
+
+    async def ok(self):
+        return 'ok'
+
+    async def first(self):
+        await asyncio.sleep(0.01)
+        raise ValueError('first')
+
+    async def second(self):
+        raise KeyError('second')
+
+########################################
+# Test Cases
+
+class ARenderTestCase(unittest.TestCase):
+
+    def runTest(self):
+        tracker = Tracker()
+        ent = AsyncEntity(RepresentMe(), tracker=tracker)
+
+        result = asyncio.run(ent.arender())
+        self.assertEqual(result, ASYNC_EXPECTED_HASH)
+        self.assertEqual(list(result), AsyncEntity._FIELDS_)
+
+        # slow was awaited once, by both the render and label
+        self.assertEqual(tracker.calls, 3)
+        self.assertEqual(tracker.max_running, 3)
+
+        # the memo does not outlive the render
+        self.assertIsNone(ent._Entity__memo)
+
+
+class ARenderSuppressTestCase(unittest.TestCase):
+
+    def runTest(self):
+        obj = RepresentMe()
+        obj.foobar = 0
+        ent = AsyncEntity(obj, tracker=Tracker())
+
+        result = asyncio.run(ent.arender())
+        self.assertEqual(list(result), ['haha', 'slow', 'slower', 'label', 'foobar'])
+
+
+class ARenderConcurrencyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        tracker = Tracker()
+        ent = AsyncEntity(RepresentMe(), tracker=tracker)
+
+        self.assertEqual(asyncio.run(ent.arender(concurrency=2)), ASYNC_EXPECTED_HASH)
+        self.assertEqual(tracker.max_running, 2)
+
+
+class ARenderAwaitingLaterFieldTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # label awaits slow, which comes after it and needs a slot too
+        class AwaitingEntity(AsyncEntity):
+            _FIELDS_ = ['label', 'slow', 'slower']
+
+        for concurrency in (1, 2):
+            tracker = Tracker()
+            ent = AwaitingEntity(RepresentMe(), tracker=tracker)
+            result = asyncio.run(asyncio.wait_for(ent.arender(concurrency=concurrency), 5))
+            self.assertEqual(result, {'label' : 'label slow', 'slow' : 'slow', 'slower' : 'slower'})
+            self.assertEqual(tracker.max_running, concurrency)
+
+        tracker = Tracker()
+        rendered = asyncio.run(asyncio.wait_for(
+            AwaitingEntity.arender_many([RepresentMe()] * 3, concurrency=1, tracker=tracker),
+            5,
+        ))
+        self.assertEqual(len(rendered), 3)
+        self.assertEqual(tracker.max_running, 1)
+
+
+class ARenderSyncEntityTestCase(unittest.TestCase):
+
+    def runTest(self):
+        ent = MainEntity(RepresentMe(), aux_object=AuxObject())
+        self.assertEqual(asyncio.run(ent.arender()), MAIN_EXPECTED_HASH)
+
+
+class ARenderExceptionTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # the first failing field in _FIELDS_ wins, not the first to fail
+        with self.assertRaisesRegex(ValueError, 'first'):
+            asyncio.run(FailingEntity().arender())
+
+
+class ARenderStartFailureTestCase(unittest.TestCase):
+
+    def runTest(self):
+        # a field that fails before anything is awaited
+        # cancels the tasks already started
+        finished = []
+
+        class BrokenEntity(Entity):
+            _FIELDS_ = ['slow', 'broken']
+
+            async def slow(self):
+                await asyncio.sleep(0.01)
+                finished.append(self)
+                return 'slow'
+
+            def broken(self):
+                raise ValueError('broken')
+
+        async def render(awaitable):
+            with self.assertRaisesRegex(ValueError, 'broken'):
+                await awaitable
+            # nothing is left running, or runs later
+            self.assertEqual(asyncio.all_tasks(), set([asyncio.current_task()]))
+            await asyncio.sleep(0.02)
+
+        asyncio.run(render(BrokenEntity().arender()))
+        asyncio.run(render(BrokenEntity.arender_many([None] * 3)))
+        self.assertEqual(finished, [])
+
+
+class ARenderManyTestCase(unittest.TestCase):
+
+    def runTest(self):
+        objs = [RepresentMe() for i in range(5)]
+        objs[2].foobar = 0
+        tracker = Tracker()
+
+        rendered = asyncio.run(AsyncEntity.arender_many(objs, tracker=tracker))
+        self.assertEqual(len(rendered), 5)
+        self.assertEqual(rendered[0], ASYNC_EXPECTED_HASH)
+        self.assertNotIn('maybe', rendered[2])
+        self.assertEqual(tracker.max_running, 15)
+
+        tracker = Tracker()
+        rendered = asyncio.run(AsyncEntity.arender_many(objs, concurrency=4, tracker=tracker))
+        self.assertEqual(rendered[4], ASYNC_EXPECTED_HASH)
+        # label gives its slot up while it awaits slow
+        self.assertEqual(tracker.max_running, 4)
+
+
+class ARenderManyBatchSizeTestCase(unittest.TestCase):
+
+    def runTest(self):
+        class SmallBatchEntity(AsyncEntity):
+            _BATCH_SIZE_ = 2
+
+        tracker = Tracker()
+        rendered = asyncio.run(SmallBatchEntity.arender_many([RepresentMe()] * 5, tracker=tracker))
+        self.assertEqual(rendered, [ASYNC_EXPECTED_HASH] * 5)
+        self.assertEqual(tracker.max_running, 6)
+
+
+class ARenderManyAuxObjectsTestCase(unittest.TestCase):
+
+    def runTest(self):
+        with self.assertRaisesRegex(TypeError, 'tracker'):
+            AsyncEntity.arender_many([])
+
+        with self.assertRaisesRegex(ValueError, 'render option'):
+            class ConcurrencyAuxEntity(Entity):
+                _AUX_OBJECTS_ = ['concurrency']
+
+
+class ARenderPrefetchTestCase(unittest.TestCase):
+
+    def runTest(self):
+        calls = []
+
+        class PrefetchingAsyncEntity(Entity):
+            _FIELDS_ = ['group']
+            _PREFETCH_ = ['groups']
+
+            @classmethod
+            def prefetch(cls, entities, related):
+                calls.append(len(entities))
+                return {'groups' : ['group'] * len(entities)}
+
+            async def group(self):
+                return self.prefetched('groups')
+
+        rendered = asyncio.run(PrefetchingAsyncEntity.arender_many([RepresentMe()] * 3))
+        self.assertEqual(rendered, [{'group' : 'group'}] * 3)
+        self.assertEqual(asyncio.run(PrefetchingAsyncEntity().arender()), {'group' : 'group'})
+        self.assertEqual(calls, [3, 1])
+
+
+if __name__ == "__main__":
+    unittest.main()